@@ -0,0 +1,148 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Barridos de hiperparametros de Modelamiento.ipynb, corridos en paralelo: cada configuracion es una
+# lista de argumentos de Entrenar_Modelo.py y cada proceso del pool entrena con su propia porcion de
+# nucleos, en vez de correr las configuraciones una detras de otra
+
+# Argumentos comunes del notebook (sus valores por defecto con --batch_size 256 y --epochs 30); cada
+# configuracion agrega los suyos despues, y argparse se queda con el ultimo valor de cada bandera
+BASE_NOTEBOOK = ["--batch_size", "256", "--epochs", "30", "--num_hidden_units", "128", "--num_hidden_layers", "2",
+                 "--regularizers", "0.01", "--same_neurons", "0", "--normalization", "0", "--activation", "relu"]
+
+CAPAS = [1, 2, 3, 4]
+NEURONAS = [32, 64, 128, 256]
+
+GRILLAS = {
+    # Capas x neuronas con dropout
+    "capas_neuronas": [["--num_hidden_layers", str(capas), "--num_hidden_units", str(neuronas), "--normalization", "1"]
+                       for capas in CAPAS for neuronas in NEURONAS],
+    # Capas x neuronas, disminuyendo las neuronas por capa
+    "capas_neuronas_decrecientes": [["--num_hidden_layers", str(capas), "--num_hidden_units", str(neuronas), "--same_neurons", "1"]
+                                    for capas in CAPAS for neuronas in NEURONAS],
+    # Funciones de activacion con 1 capa de 256 neuronas
+    "activaciones": [["--num_hidden_units", "256", "--num_hidden_layers", "1", "--activation", activacion]
+                     for activacion in ["relu", "tanh", "prelu"]],
+    # PReLU con varias capas de anchos decrecientes (cada capa con su propia PReLU)
+    "prelu_capas": [["--num_hidden_units", "256", "--num_hidden_layers", str(capas), "--same_neurons", "1", "--activation", "prelu"]
+                    for capas in [2, 3, 4]],
+    # Modelo base con batch normalization y con dropout
+    "regularizacion": [["--normalization", "0"], ["--normalization", "1"]],
+}
+
+# Datos ya cargados en cada proceso del pool, para no repetir la carga en cada configuracion
+_datos_proceso = {}
+
+
+def iniciar_proceso(contador, procesos, hilos):
+    """
+    Inicializador de cada proceso del pool: toma un puesto, se fija a los nucleos de ese puesto (en
+    Linux) y limita los hilos de TensorFlow a esos nucleos, para que los procesos no compitan entre si.
+    """
+    with contador.get_lock():
+        puesto = contador.value % procesos
+        contador.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        nucleos = sorted(os.sched_getaffinity(0))
+        propios = nucleos[puesto * hilos:(puesto + 1) * hilos]
+        if propios:
+            os.sched_setaffinity(0, propios)
+
+    from Entrenar_Modelo import configurar_hilos
+    configurar_hilos(hilos, 1)
+
+
+def correr_configuracion(argumentos, ruta_datos, base=()):
+    """
+    Entrena una configuracion (argumentos propios, despues de los argumentos comunes de base) dentro
+    de un proceso del pool.
+    :return: diccionario con los argumentos, el MAE de validacion y los segundos de entrenamiento
+    """
+    from Entrenar_Modelo import calcular_mae, cargar_datos, crear_parser, entrenar
+
+    args = crear_parser().parse_args(list(base) + argumentos + ["--verbose", "0"])
+    if (ruta_datos, args.comprimir) not in _datos_proceso:
+        _datos_proceso[ruta_datos, args.comprimir] = cargar_datos(ruta_datos, args.comprimir)
+    datos = _datos_proceso[ruta_datos, args.comprimir]
+
+    inicio = time.perf_counter()
+    model, _ = entrenar(args, datos)
+    segundos = time.perf_counter() - inicio
+    return {"argumentos": " ".join(argumentos), "mae_validacion": calcular_mae(model, datos["x_valid"], datos["y_valid"]),
+            "segundos": round(segundos, 1)}
+
+
+def crear_pool(procesos, hilos):
+    """
+    Pool de procesos con spawn: TensorFlow no se puede usar en un proceso creado con fork despues de
+    iniciarse en el padre, y asi cada proceso fija sus hilos antes de importarlo.
+    :return: ProcessPoolExecutor
+    """
+    contexto = multiprocessing.get_context("spawn")
+    contador = contexto.Value("i", 0)
+    return ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=iniciar_proceso,
+                               initargs=(contador, procesos, hilos))
+
+
+def repartir_nucleos(procesos, hilos):
+    """
+    :return: (procesos, hilos por proceso); por defecto un proceso por nucleo con un hilo cada uno
+    """
+    nucleos = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    procesos = procesos or max(1, nucleos // (hilos or 1))
+    hilos = hilos or max(1, nucleos // procesos)
+    return procesos, hilos
+
+
+def barrer(configuraciones, ruta_datos, procesos=0, hilos=0, base=()):
+    """
+    Reparte las configuraciones en el pool e imprime cada resultado a medida que termina.
+    :return: lista de resultados ordenada por MAE de validacion
+    """
+    procesos, hilos = repartir_nucleos(procesos, hilos)
+    print(f"{len(configuraciones)} configuraciones en {procesos} procesos de {hilos} hilo(s)")
+
+    # La matriz de diseño se arma (o se valida) una sola vez antes de crear los procesos: si no,
+    # todos intentarian escribir cache_matriz/ al mismo tiempo
+    from Matriz_Diseno import cargar_matriz
+    cargar_matriz(ruta_datos)
+
+    resultados = []
+    with crear_pool(procesos, hilos) as pool:
+        futuros = [pool.submit(correr_configuracion, argumentos, ruta_datos, base) for argumentos in configuraciones]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            print(f"MAE {resultado['mae_validacion']:.3f} en {resultado['segundos']} s: {resultado['argumentos']}")
+            resultados.append(resultado)
+    return sorted(resultados, key=lambda resultado: resultado["mae_validacion"])
+
+
+def guardar_resultados(resultados, ruta):
+    with open(ruta, "w", newline="", encoding="utf-8") as archivo:
+        escritor = csv.DictWriter(archivo, fieldnames=list(resultados[0]))
+        escritor.writeheader()
+        escritor.writerows(resultados)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Barrido en paralelo de las grillas de hiperparametros de Modelamiento.ipynb')
+    parser.add_argument('--grillas', nargs='+', default=list(GRILLAS), choices=list(GRILLAS))
+    parser.add_argument('--datos', type=str, default='datos_limpios')
+    parser.add_argument('--procesos', '-p', type=int, default=0, help='procesos en paralelo (0: nucleos / hilos)')
+    parser.add_argument('--hilos', type=int, default=0, help='hilos de TensorFlow por proceso (0: nucleos / procesos)')
+    parser.add_argument('--epochs', '-e', type=int, default=None, help='epocas de cada configuracion (por defecto las del notebook)')
+    parser.add_argument('--comprimir', type=int, default=0, help='1 para entrenar con los perfiles distintos (ver Entrenar_Modelo.py)')
+    parser.add_argument('--salida', '-o', type=str, default='resultados_barrido.csv')
+    args = parser.parse_args()
+
+    base = BASE_NOTEBOOK + (["--epochs", str(args.epochs)] if args.epochs else []) + ["--comprimir", str(args.comprimir)]
+    configuraciones = [configuracion for grilla in args.grillas for configuracion in GRILLAS[grilla]]
+
+    inicio = time.perf_counter()
+    resultados = barrer(configuraciones, args.datos, args.procesos, args.hilos, base)
+    guardar_resultados(resultados, args.salida)
+    print(f"Barrido terminado en {time.perf_counter() - inicio:.0f} s; resultados en {args.salida}")
@@ -0,0 +1,163 @@
+import argparse
+import math
+import os
+import random
+import time
+
+from Barrido_Modelos import _datos_proceso, crear_pool, guardar_resultados, repartir_nucleos
+
+# Busqueda de hiperparametros con halving sucesivo (y Hyperband, que corre varios halving con distinto
+# balance entre cantidad de configuraciones y epocas): todas las configuraciones empiezan con pocas
+# epocas, solo la mejor fraccion (1/eta) sigue entrenando y asi hasta llegar a las epocas completas.
+# Las que siguen retoman su modelo guardado en vez de empezar de cero
+
+# Valores posibles de los hiperparametros de Entrenar_Modelo.py
+ESPACIO = {
+    "num_hidden_units": [32, 64, 128, 256],
+    "num_hidden_layers": [1, 2, 3, 4],
+    "regularizers": [0.0, 0.01, 0.1, 0.2],
+    "dropout": [0.1, 0.2, 0.3],
+    "activation": ["relu", "tanh", "prelu"],
+    "normalization": [0, 1],
+    "same_neurons": [0, 1],
+}
+
+
+def muestrear_configuraciones(cantidad, semilla=42):
+    """
+    Configuraciones distintas tomadas al azar del espacio de busqueda.
+    :return: lista de listas de argumentos de Entrenar_Modelo.py
+    """
+    rng = random.Random(semilla)
+    total = math.prod(len(valores) for valores in ESPACIO.values())
+    vistas, configuraciones = set(), []
+    while len(configuraciones) < min(cantidad, total):
+        valores = tuple(rng.choice(opciones) for opciones in ESPACIO.values())
+        if valores not in vistas:
+            vistas.add(valores)
+            configuraciones.append([argumento for nombre, valor in zip(ESPACIO, valores)
+                                    for argumento in (f"--{nombre}", str(valor))])
+    return configuraciones
+
+
+def entrenar_tramo(clave, argumentos, epoca_inicial, epoca_final, ruta_datos, directorio, base=()):
+    """
+    Entrena una configuracion desde epoca_inicial hasta epoca_final dentro de un proceso del pool,
+    retomando el modelo guardado en el tramo anterior, y lo guarda para el siguiente tramo.
+    :return: (clave, MAE de validacion)
+    """
+    import keras
+    from Entrenar_Modelo import calcular_mae, cargar_datos, crear_parser, entrenar
+
+    args = crear_parser().parse_args(list(base) + argumentos + ["--epochs", str(epoca_final), "--verbose", "0"])
+    if (ruta_datos, args.comprimir) not in _datos_proceso:
+        _datos_proceso[ruta_datos, args.comprimir] = cargar_datos(ruta_datos, args.comprimir)
+    datos = _datos_proceso[ruta_datos, args.comprimir]
+
+    ruta_modelo = os.path.join(directorio, f"{clave}.keras")
+    model = keras.models.load_model(ruta_modelo) if epoca_inicial else None
+    model, _ = entrenar(args, datos, model=model, initial_epoch=epoca_inicial)
+    model.save(ruta_modelo)
+    return clave, calcular_mae(model, datos["x_valid"], datos["y_valid"])
+
+
+def halving_sucesivo(pool, configuraciones, epocas_min, epocas_max, eta, ruta_datos, directorio, base=(), prefijo="c"):
+    """
+    Corre un halving sucesivo: cada ronda entrena las configuraciones vivas hasta la epoca de la ronda,
+    conserva la mejor fraccion 1/eta y multiplica las epocas por eta, hasta llegar a epocas_max.
+    :return: lista de resultados de todas las rondas y epocas entrenadas en total
+    """
+    vivas = {f"{prefijo}{i}": configuracion for i, configuracion in enumerate(configuraciones)}
+    epoca_inicial, epoca_final = 0, min(epocas_min, epocas_max)
+    resultados, epocas_totales = [], 0
+    while True:
+        futuros = [pool.submit(entrenar_tramo, clave, configuracion, epoca_inicial, epoca_final, ruta_datos, directorio, base)
+                   for clave, configuracion in vivas.items()]
+        maes = dict(futuro.result() for futuro in futuros)
+        epocas_totales += (epoca_final - epoca_inicial) * len(vivas)
+        for clave, mae in sorted(maes.items(), key=lambda item: item[1]):
+            resultados.append({"clave": clave, "epocas": epoca_final, "mae_validacion": mae,
+                               "argumentos": " ".join(vivas[clave])})
+            print(f"[{epoca_final} epocas] MAE {mae:.3f}: {' '.join(vivas[clave])}")
+
+        if epoca_final >= epocas_max or len(vivas) == 1:
+            break
+        # Solo sigue la mejor fraccion; los modelos de las demas se borran
+        seguir = sorted(maes, key=maes.get)[:max(1, len(vivas) // eta)]
+        for clave in set(vivas) - set(seguir):
+            os.remove(os.path.join(directorio, f"{clave}.keras"))
+        vivas = {clave: vivas[clave] for clave in seguir}
+        epoca_inicial, epoca_final = epoca_final, min(epoca_final * eta, epocas_max)
+    return resultados, epocas_totales
+
+
+def corchetes_hyperband(epocas_min, epocas_max, eta):
+    """
+    Corchetes de Hyperband: el primero prueba muchas configuraciones con pocas epocas y el ultimo pocas
+    configuraciones con todas las epocas desde el comienzo.
+    :return: lista de (cantidad de configuraciones, epocas iniciales)
+    """
+    s_max = int(math.log(epocas_max / epocas_min, eta) + 1e-9)
+    return [(math.ceil((s_max + 1) / (s + 1) * eta ** s), max(epocas_min, round(epocas_max / eta ** s)))
+            for s in range(s_max, -1, -1)]
+
+
+def buscar(metodo, configuraciones_iniciales, epocas_min, epocas_max, eta, ruta_datos, directorio,
+           procesos=0, hilos=0, base=(), semilla=42):
+    """
+    :return: resultados de todas las rondas y epocas entrenadas en total
+    """
+    procesos, hilos = repartir_nucleos(procesos, hilos)
+    os.makedirs(directorio, exist_ok=True)
+    # La matriz de diseño se arma una sola vez antes de crear los procesos (ver Barrido_Modelos.py)
+    from Matriz_Diseno import cargar_matriz
+    cargar_matriz(ruta_datos)
+
+    if metodo == "halving":
+        corchetes = [(configuraciones_iniciales, epocas_min)]
+    else:
+        corchetes = corchetes_hyperband(epocas_min, epocas_max, eta)
+
+    resultados, epocas_totales = [], 0
+    with crear_pool(procesos, hilos) as pool:
+        for numero, (cantidad, epocas_iniciales) in enumerate(corchetes):
+            print(f"Corchete {numero}: {cantidad} configuraciones desde {epocas_iniciales} epocas")
+            configuraciones = muestrear_configuraciones(cantidad, semilla + numero)
+            resultados_corchete, epocas = halving_sucesivo(pool, configuraciones, epocas_iniciales, epocas_max, eta,
+                                                           ruta_datos, directorio, base, prefijo=f"b{numero}c")
+            resultados += resultados_corchete
+            epocas_totales += epocas
+    return resultados, epocas_totales
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Busqueda de hiperparametros con halving sucesivo o Hyperband')
+    parser.add_argument('--metodo', type=str, default='halving', choices=['halving', 'hyperband'])
+    parser.add_argument('--configuraciones', '-n', type=int, default=27, help='configuraciones iniciales (solo halving)')
+    parser.add_argument('--epocas_min', type=int, default=2)
+    parser.add_argument('--epocas_max', type=int, default=30)
+    parser.add_argument('--eta', type=int, default=3, help='en cada ronda sigue 1 de cada eta configuraciones')
+    parser.add_argument('--datos', type=str, default='datos_limpios')
+    parser.add_argument('--directorio', type=str, default='busqueda_modelos', help='donde se guardan los modelos entre rondas')
+    parser.add_argument('--procesos', '-p', type=int, default=0)
+    parser.add_argument('--hilos', type=int, default=0)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--comprimir', type=int, default=0, help='1 para entrenar con los perfiles distintos (ver Entrenar_Modelo.py)')
+    parser.add_argument('--salida', '-o', type=str, default='resultados_busqueda.csv')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    resultados, epocas_totales = buscar(args.metodo, args.configuraciones, args.epocas_min, args.epocas_max, args.eta,
+                                        args.datos, args.directorio, args.procesos, args.hilos,
+                                        ["--batch_size", "256", "--comprimir", str(args.comprimir)], args.semilla)
+    guardar_resultados(resultados, args.salida)
+
+    # La mejor configuracion entre las que llegaron a la ronda final
+    epocas_finales = max(resultado["epocas"] for resultado in resultados)
+    completas = [resultado for resultado in resultados if resultado["epocas"] == epocas_finales]
+    mejor = min(completas, key=lambda resultado: resultado["mae_validacion"])
+    configuraciones_totales = len({resultado["clave"] for resultado in resultados})
+    print(f"Mejor configuracion (MAE de validacion {mejor['mae_validacion']:.3f}): {mejor['argumentos']}")
+    print(f"Modelo guardado en {os.path.join(args.directorio, mejor['clave'] + '.keras')}")
+    print(f"{epocas_totales} epocas entrenadas en {time.perf_counter() - inicio:.0f} s; entrenar las "
+          f"{configuraciones_totales} configuraciones completas serian {configuraciones_totales * args.epocas_max} epocas")
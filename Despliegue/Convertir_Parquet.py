@@ -0,0 +1,28 @@
+import argparse
+
+import pandas as pd
+
+
+def tipar_columnas(data):
+    """
+    Las columnas de texto (municipio, estrato, jornada...) tienen pocas categorias distintas, asi que
+    se guardan como category (diccionario en Parquet); los enteros se reducen al tipo mas pequeño.
+    :return: DataFrame con los tipos compactos
+    """
+    for columna in data.columns:
+        if pd.api.types.is_integer_dtype(data[columna]):
+            data[columna] = pd.to_numeric(data[columna], downcast='integer')
+        elif not pd.api.types.is_numeric_dtype(data[columna]):
+            data[columna] = data[columna].astype('category')
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convierte los datos limpios de CSV a Parquet con columnas categoricas')
+    parser.add_argument('--entrada', '-i', type=str, default='datos_limpios.csv')
+    parser.add_argument('--salida', '-o', type=str, default='datos_limpios.parquet')
+    args = parser.parse_args()
+
+    data = tipar_columnas(pd.read_csv(args.entrada))
+    data.to_parquet(args.salida, index=False)
+    print(f"{len(data)} filas escritas en {args.salida}")
@@ -1,124 +1,315 @@
-import pandas as pd
+import argparse
+import os
+import time
 
-data_completa = pd.read_csv("datos_limpios.csv")
+import keras
+import numpy as np
+import tensorflow as tf
+from keras import layers
+from keras import regularizers
+from sklearn.model_selection import train_test_split
 
-data_encoded = pd.get_dummies(data_completa, columns=['cole_area_ubicacion', 'cole_caracter', 'cole_genero', 'cole_jornada', 'cole_mcpio_ubicacion', 
-                                                      'cole_naturaleza', 'estu_genero', 'estu_mcpio_presentacion', 'estu_mcpio_reside',
-                                                      'fami_cuartoshogar', 'fami_educacionmadre', 'fami_educacionpadre', 'fami_estratovivienda', 
-                                                      'fami_personashogar', 'fami_tieneautomovil', 'fami_tienecomputador', 'fami_tieneinternet', 
-                                                      'fami_tienelavadora', 'desemp_ingles'], drop_first=True)
-data_encoded = data_encoded.astype(int)
+from Matriz_Diseno import cargar_matriz, comprimir_matriz, guardar_esquema
 
-data_x = data_encoded.drop(['periodo', 'punt_ingles', 'punt_matematicas', 'punt_sociales_ciudadanas', 'punt_c_naturales', 'punt_lectura_critica',
-                            'punt_global'], axis=1)
-data_y = data_encoded['punt_global']
 
-import sklearn
-from sklearn.model_selection import train_test_split
+def crear_parser():
+    """
+    Usaremos argparse para pasarle argumentos a las funciones de entrenamiento. Los valores por defecto
+    son los del modelo final del notebook de modelamiento (1 capa de 128 neuronas, l2 de 0.2)
+    :return: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description='Entrenamiento de una red feed-forward para la regresion del puntaje global del Saber 11 en TensorFlow/Keras')
+    parser.add_argument('--batch_size', '-b', type=int, default=256)
+    parser.add_argument('--epochs', '-e', type=int, default=30)
+    parser.add_argument('--learning_rate', '-l', type=float, default=0.001)
+    parser.add_argument('--num_hidden_units', '-n', type=int, default=128)
+    parser.add_argument('--num_hidden_layers', '-N', type=int, default=1)
+    parser.add_argument('--regularizers', '-r', type=float, default=0.2)
+    parser.add_argument('--dropout', '-d', type=float, default=0.20)
+    parser.add_argument('--activation', '-a', type=str, default='relu', choices=['relu', 'tanh', 'prelu'])
+    parser.add_argument('--same_neurons', '-s', type=int, default=1)
+    parser.add_argument('--normalization', '-t', type=int, default=0)
+    parser.add_argument('--entrada', type=str, default='tfdata', choices=['tfdata', 'arreglos'])
+    parser.add_argument('--datos', type=str, default='datos_limpios')
+    parser.add_argument('--modelo', type=str, default='modelo_proyecto3.keras')
+    parser.add_argument('--hilos_intra', type=int, default=0, help='hilos de TensorFlow por operacion (0: todos los nucleos)')
+    parser.add_argument('--hilos_inter', type=int, default=0, help='operaciones de TensorFlow en paralelo (0: automatico)')
+    parser.add_argument('--mlflow', type=int, default=0, help='1 para registrar la corrida en MLflow')
+    parser.add_argument('--nombre', type=str, default='proyecto_3_regresion_model', help='nombre de la corrida en MLflow')
+    parser.add_argument('--verbose', '-v', type=int, default=1, help='0 para entrenar sin barra de progreso ni tiempos por epoca')
+    parser.add_argument('--tipo', type=str, default='red', choices=['red', 'ridge'],
+                        help='ridge: solo la linea base lineal (ver Modelo_Lineal.py), sin Keras')
+    parser.add_argument('--salida_lineal', type=str, default='modelo_lineal.npz',
+                        help='pesos de la ridge con --tipo ridge; el esquema queda al lado como esquema_lineal.json')
+    parser.add_argument('--alfa', type=float, default=1.0, help='penalizacion l2 de la linea base ridge')
+    parser.add_argument('--comprimir', type=int, default=0,
+                        help='1 para entrenar con un peso por perfil distinto de la matriz one-hot en vez de una fila por estudiante')
+    parser.add_argument('--paciencia', type=int, default=0,
+                        help='epocas sin mejorar la perdida de validacion antes de detener el entrenamiento (0: sin detencion temprana)')
+    return parser
 
-x_train_full, x_test, y_train_full, y_test = train_test_split(
-    data_x, data_y, test_size=0.2, random_state=42) #Dividir el conjunto de datos en entrenamiento y valaidacion, 80% entrenamiento, 20% validacion
 
-x_train, x_valid, y_train, y_valid = train_test_split(
-    x_train_full, y_train_full, test_size=0.2, random_state=42) #Dividir el conjunto en  entrenamiento
+def configurar_hilos(intra, inter):
+    """
+    Fija los hilos de TensorFlow. Tiene que llamarse antes de la primera operacion de TensorFlow.
+    """
+    if intra:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+    if inter:
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
 
-# Usaremos argparse para pasarle argumentos a las funciones de entrenamiento
-import argparse
 
-parser = argparse.ArgumentParser(description='Entrenamiento de una red feed-forward para el problema de clasificación con datos MNIST en TensorFlow/Keras')
-parser.add_argument('--batch_size', '-b', type=int, default=32)
-parser.add_argument('--epochs', '-e', type=int, default=40)
-parser.add_argument('--learning_rate', '-l', type=float, default=0.001)
-parser.add_argument('--num_hidden_units', '-n', type=int, default=128)
-parser.add_argument('--num_hidden_layers', '-N', type=int, default=2)
-parser.add_argument('--regularizers', '-r', type=float, default=0.01)
-parser.add_argument('--dropout', '-d', type=float, default=0.20)
-parser.add_argument('--activation', '-a', type=str, default='relu')
-parser.add_argument('--same_neurons', '-s', type=int, default=0)
-parser.add_argument('--normalization', '-t', type=int, default=0)
-args = parser.parse_args([])
-
-import mlflow 
-import mlflow.keras
-import keras
-import tensorflow as tf
-import tensorflow.keras as tk
-from keras import models
-from keras import layers
-from keras import regularizers
+def cargar_datos(ruta_datos, comprimir=False):
+    """
+    Matriz de diseño one-hot en uint8 y puntaje global, guardadas en cache_matriz/ y abiertas con mmap.
+    Solo se vuelve a codificar si datos_limpios (un directorio por periodo) cambio (ver Matriz_Diseno.py)
+    Con comprimir, el conjunto de entrenamiento queda con una fila por perfil distinto (y es la media de
+    su puntaje) y sus conteos y varianzas; validacion y prueba siguen con una fila por estudiante.
+    :return: diccionario con los conjuntos de entrenamiento, validacion y prueba, y el esquema
+    """
+    data_x, data_y, esquema = cargar_matriz(ruta_datos)
+
+    x_train_full, x_test, y_train_full, y_test = train_test_split(
+        data_x, data_y, test_size=0.2, random_state=42) #Dividir el conjunto de datos en entrenamiento y valaidacion, 80% entrenamiento, 20% validacion
+
+    x_train, x_valid, y_train, y_valid = train_test_split(
+        x_train_full, y_train_full, test_size=0.2, random_state=42) #Dividir el conjunto en  entrenamiento
 
-def get_optimizer():
+    datos = {"x_train": x_train, "y_train": y_train, "x_valid": x_valid, "y_valid": y_valid,
+             "x_test": x_test, "y_test": y_test, "esquema": esquema}
+    if comprimir:
+        datos["x_train"], datos["conteos_train"], datos["y_train"], datos["varianzas_train"] = comprimir_matriz(x_train, y_train)
+    return datos
+
+
+def get_optimizer(args):
     """
     :return: Keras optimizer
     """
     optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate)
     return optimizer
 
-args = parser.parse_args(["--batch_size", '256', "--epochs", '30',"--num_hidden_units", '128', "--num_hidden_layers", '1',
-                           "--regularizers", '0.2', "--same_neurons", '1'])
-
-if args.activation == 'relu':
-    act_func = tf.nn.relu
-elif args.activation == 'tanh':
-    act_func = tf.nn.tanh
-elif args.activation == 'prelu':
-    act_func = layers.PReLU()
-
-# definimos la capa de entrada
-input_layer = layers.Input(shape=(148,))  # 148 variables de entrada
-x = input_layer
-
-neurons = [0] * 4
-# Agregamos capas ocultas a la red
-for n in range(0, args.num_hidden_layers):
-    if args.normalization == 0:
-        if args.same_neurons == 0:
-            neurons[n] = args.num_hidden_units
-            # agregamos una capa densa (completamente conectada)
-            x = layers.Dense(neurons[n], activation=act_func,kernel_regularizer=regularizers.l2(args.regularizers))(x)
-            # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
-            # x = layers.Dropout(args.dropout)(x)
-            x = layers.BatchNormalization()(x)
-        else: 
-            neurons[n] = args.num_hidden_units/(2 ** (n - 1))
-            # agregamos una capa densa (completamente conectada)
-            x = layers.Dense(neurons[n], activation=act_func,kernel_regularizer=regularizers.l2(args.regularizers))(x)
-            # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
-            # x = layers.Dropout(args.dropout)(x)
-            x = layers.BatchNormalization()(x)
+
+def construir_modelo(args, n_entradas):
+    """
+    :return: modelo de Keras compilado
+    """
+    if args.activation == 'relu':
+        act_func = tf.nn.relu
+    elif args.activation == 'tanh':
+        act_func = tf.nn.tanh
+    elif args.activation == 'prelu':
+        # se crea una PReLU por capa dentro del ciclo: sus parametros tienen el ancho de su capa
+        act_func = None
+
+    # definimos la capa de entrada, una variable por columna one-hot del esquema
+    input_layer = layers.Input(shape=(n_entradas,))
+    x = input_layer
+
+    neurons = [0] * 4
+    # Agregamos capas ocultas a la red
+    for n in range(0, args.num_hidden_layers):
+        if args.activation == 'prelu':
+            act_func = layers.PReLU()
+        if args.normalization == 0:
+            if args.same_neurons == 0:
+                neurons[n] = args.num_hidden_units
+                # agregamos una capa densa (completamente conectada)
+                x = layers.Dense(neurons[n], activation=act_func,kernel_regularizer=regularizers.l2(args.regularizers))(x)
+                # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
+                # x = layers.Dropout(args.dropout)(x)
+                x = layers.BatchNormalization()(x)
+            else:
+                neurons[n] = int(args.num_hidden_units/(2 ** (n - 1)))
+                # agregamos una capa densa (completamente conectada)
+                x = layers.Dense(neurons[n], activation=act_func,kernel_regularizer=regularizers.l2(args.regularizers))(x)
+                # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
+                # x = layers.Dropout(args.dropout)(x)
+                x = layers.BatchNormalization()(x)
+        else:
+            if args.same_neurons == 0:
+                neurons[n] = args.num_hidden_units
+                # agregamos una capa densa (completamente conectada)
+                x = layers.Dense(neurons[n], activation=act_func)(x)
+                # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
+                x = layers.Dropout(args.dropout)(x)
+                # x = layers.BatchNormalization()(x)
+            else:
+                neurons[n] = int(args.num_hidden_units/(2 ** (n - 1)))
+                # agregamos una capa densa (completamente conectada)
+                x = layers.Dense(neurons[n], activation=act_func)(x)
+                # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
+                x = layers.Dropout(args.dropout)(x)
+                # x = layers.BatchNormalization()(x)
+
+    # capa final con 1 nodo de salida y sin activacion por lo que es de regresion
+    output_layer = layers.Dense(1)(x)
+
+    # Se arma el modelo:
+    model = keras.Model(input_layer, output_layer)
+    # https://keras.io/optimizers/
+    optimizer = get_optimizer(args)
+
+    # compilamos el modelo y definimos la función de pérdida
+    # otras funciones de pérdida comunes para problemas de clasificación
+    # 1. sparse_categorical_crossentropy
+    # 2. binary_crossentropy
+    model.compile(optimizer=optimizer,
+                    loss='mean_absolute_error',
+                    metrics=['mse'])
+    return model
+
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def crear_dataset(x, y, batch_size, mezclar=False, semilla=42, pesos=None):
+    """
+    Dataset de tf.data sobre los arreglos compactos (x en uint8). Las filas no se mezclan una por una:
+    en cada epoca se permuta el vector de posiciones, se parte en lotes y cada lote se arma con un
+    gather, se convierte a float32 y queda listo mientras el modelo entrena con el anterior (prefetch).
+    Los arreglos ya estan en memoria, asi que no hace falta .cache(); un cache despues de mezclar
+    repetiria el mismo orden en todas las epocas.
+    Con pesos, cada lote lleva tambien el peso de sus filas (sample_weight de Keras).
+    :return: tf.data.Dataset de lotes (x float32, y) o (x float32, y, pesos)
+    """
+    filas = len(y)
+    x, y = tf.constant(x), tf.constant(y)
+    if mezclar:
+        # Keras crea un iterador nuevo en cada epoca y un shuffle con semilla fija repetiria el mismo
+        # orden en todos: Dataset.random entrega otra semilla en cada iteracion y la permutacion se
+        # hace con un shuffle sin estado a partir de ella
+        rango = tf.range(filas, dtype=tf.int64)
+        posiciones = tf.data.Dataset.random(seed=semilla, rerandomize_each_iteration=True).take(1).map(
+            lambda semilla_epoca: tf.random.experimental.stateless_shuffle(rango, seed=tf.stack([semilla_epoca, 0])))
+    else:
+        posiciones = tf.data.Dataset.from_tensors(tf.range(filas, dtype=tf.int64))
+    lotes = posiciones.flat_map(lambda orden: tf.data.Dataset.from_tensor_slices(orden).batch(batch_size))
+    lotes = lotes.apply(tf.data.experimental.assert_cardinality(-(-filas // batch_size)))
+    if pesos is None:
+        dataset = lotes.map(lambda lote: (tf.cast(tf.gather(x, lote), tf.float32), tf.gather(y, lote)),
+                            num_parallel_calls=AUTOTUNE)
+    else:
+        pesos = tf.constant(pesos, dtype=tf.float32)
+        dataset = lotes.map(lambda lote: (tf.cast(tf.gather(x, lote), tf.float32), tf.gather(y, lote), tf.gather(pesos, lote)),
+                            num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+class TiempoPorEpoca(keras.callbacks.Callback):
+    """
+    Imprime el tiempo de pared de cada epoca (incluida la validacion) y las filas de entrenamiento por
+    segundo, para comparar las formas de entrada en las maquinas de entrenamiento sin GPU.
+    """
+    def __init__(self, filas):
+        super().__init__()
+        self.filas = filas
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.inicio = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        segundos = time.perf_counter() - self.inicio
+        print(f"Epoca {epoch + 1}: {segundos:.2f} s ({self.filas / segundos:,.0f} filas/s)")
+
+
+
+def entrenar(args, datos, callbacks=(), model=None, initial_epoch=0):
+    """
+    Construye el modelo con los hiperparametros de args y lo entrena con los datos de cargar_datos hasta
+    la epoca args.epochs. Con model e initial_epoch continua el entrenamiento de un modelo ya iniciado.
+    :return: (modelo entrenado, historia de Keras)
+    """
+    if model is None:
+        model = construir_modelo(args, datos["x_train"].shape[1])
+    callbacks = list(callbacks)
+    if args.verbose:
+        callbacks.append(TiempoPorEpoca(len(datos["x_train"])))
+    if args.paciencia:
+        # Detiene las corridas que dejaron de mejorar y se queda con los pesos de la mejor epoca
+        callbacks.append(keras.callbacks.EarlyStopping(monitor='val_loss', patience=args.paciencia, restore_best_weights=True))
+
+    # Con los datos comprimidos cada perfil pesa la cantidad de estudiantes que representa, escalada a
+    # media 1 para que la perdida de cada lote quede en la misma escala que sin comprimir. Con MAE
+    # es una aproximacion (se ajusta a la media de cada perfil y no a sus puntajes individuales)
+    pesos = None
+    if "conteos_train" in datos:
+        pesos = (datos["conteos_train"] / datos["conteos_train"].mean()).astype(np.float32)
+
+    # entrenamos el modelo
+    if args.entrada == 'tfdata':
+        history = model.fit(crear_dataset(datos["x_train"], datos["y_train"], args.batch_size, mezclar=True, pesos=pesos),
+                            epochs=args.epochs, validation_data=crear_dataset(datos["x_valid"], datos["y_valid"], args.batch_size),
+                            callbacks=callbacks, verbose=args.verbose, shuffle=False, initial_epoch=initial_epoch)
     else:
-        if args.same_neurons == 0:
-            neurons[n] = args.num_hidden_units
-            # agregamos una capa densa (completamente conectada)
-            x = layers.Dense(neurons[n], activation=act_func)(x)
-            # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
-            x = layers.Dropout(args.dropout)(x)
-            # x = layers.BatchNormalization()(x)
-        else: 
-            neurons[n] = args.num_hidden_units/(2 ** (n - 1))
-            # agregamos una capa densa (completamente conectada)
-            x = layers.Dense(neurons[n], activation=act_func)(x)
-            # agregamos dropout o normalizacion como método de regularización para aleatoriamente descartar una capa si los gradientes son muy pequeños
-            x = layers.Dropout(args.dropout)(x)
-            # x = layers.BatchNormalization()(x)
-
-# capa final con 1 nodo de salida y sin activacion por lo que es de regresion
-output_layer = layers.Dense(1)(x)
-
-# Se arma el modelo:
-model = keras.Model(input_layer, output_layer)
-# https://keras.io/optimizers/
-optimizer = get_optimizer()
-
-# compilamos el modelo y definimos la función de pérdida  
-# otras funciones de pérdida comunes para problemas de clasificación
-# 1. sparse_categorical_crossentropy
-# 2. binary_crossentropy
-model.compile(optimizer=optimizer,
-                loss='mean_absolute_error',
-                metrics=['mse'])
-
-# entrenamos el modelo
-model.fit(x_train, y_train, epochs=args.epochs, batch_size=args.batch_size, validation_data=(x_valid, y_valid))
-
-model.save('modelo_proyecto3.keras')
+        history = model.fit(datos["x_train"], datos["y_train"], epochs=args.epochs, batch_size=args.batch_size, sample_weight=pesos,
+                            validation_data=(datos["x_valid"], datos["y_valid"]), callbacks=callbacks, verbose=args.verbose,
+                            initial_epoch=initial_epoch)
+    return model, history
+
+
+def calcular_mae(model, x, y, batch_size=4096):
+    """
+    MAE de las predicciones (la perdida de Keras tambien suma la penalizacion l2, asi que no sirve para comparar)
+    :return: error absoluto medio
+    """
+    predicciones = model.predict(crear_dataset(x, y, batch_size), verbose=0).ravel()
+    return float(np.mean(np.abs(predicciones - y)))
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    configurar_hilos(args.hilos_intra, args.hilos_inter)
+    datos = cargar_datos(args.datos, args.comprimir)
+    if args.comprimir:
+        print(f"{len(datos['x_train'])} perfiles distintos en {datos['conteos_train'].sum()} filas de entrenamiento")
+
+    if args.mlflow:
+        import mlflow
+        import mlflow.keras
+        mlflow.start_run(run_name=args.nombre)
+        # reistro automáticos de las métricas de keras
+        mlflow.keras.autolog()
+
+    # Linea base ridge con las mismas filas de entrenamiento: una pasada sobre la matriz y un sistema
+    # de 149 x 149, unos segundos frente a los minutos de la red
+    from Modelo_Lineal import acumular_gram, guardar_lineal, predecir_lineal, resolver_ridge
+    inicio = time.perf_counter()
+    estadisticos = acumular_gram(datos["x_train"], datos["y_train"], conteos=datos.get("conteos_train"),
+                                 varianzas=datos.get("varianzas_train"))
+    pesos, intercepto = resolver_ridge(estadisticos, args.alfa)
+    mae_lineal = float(np.mean(np.abs(predecir_lineal(pesos, intercepto, datos["x_test"]) - datos["y_test"])))
+    print(f"MAE en prueba (ridge, {time.perf_counter() - inicio:.1f} s): {mae_lineal:.3f}")
+
+    if args.tipo == 'red':
+        model, _ = entrenar(args, datos)
+        mae_prueba = calcular_mae(model, datos["x_test"], datos["y_test"])
+        print(f"MAE en prueba (red): {mae_prueba:.3f}")
+    if args.mlflow:
+        mlflow.log_metric("mae_prueba_ridge", mae_lineal)
+        if args.tipo == 'red':
+            mlflow.log_metric("mae_prueba", mae_prueba)
+        mlflow.end_run()
+
+    if args.tipo == 'ridge':
+        # Una sola capa lineal en el formato de NumPy, con nombres propios como en Modelo_Lineal.py: no
+        # reemplaza el modelo que sirve el tablero (para servirla, copiar ambos archivos como
+        # modelo_proyecto3.npz y esquema_modelo.json)
+        guardar_lineal(pesos, intercepto, args.salida_lineal)
+        guardar_esquema(datos["esquema"], os.path.join(os.path.dirname(args.salida_lineal), 'esquema_lineal.json'))
+        return
+
+    # El esquema va junto al modelo: el tablero lee los dos del mismo directorio
+    guardar_esquema(datos["esquema"], os.path.join(os.path.dirname(args.modelo), 'esquema_modelo.json'))
+
+    model.save(args.modelo)
+
+    # Pesos en NumPy (con la BatchNormalization plegada) para que el tablero prediga sin TensorFlow
+    from Exportar_Modelo import exportar
+    try:
+        exportar(args.modelo, args.modelo.replace('.keras', '.npz'))
+    except (ValueError, AssertionError) as error:
+        # Por ejemplo con activacion prelu: exportar borra el .npz anterior y el tablero usara Keras
+        print(f"No se exportan los pesos NumPy: {error}")
+
+
+if __name__ == "__main__":
+    main()
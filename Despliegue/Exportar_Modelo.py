@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from Tablero.inferencia import ACTIVACIONES, ModeloNumpy
+
+
+def plegar_capas(model):
+    """
+    Recorre las capas de una red densa de Keras y devuelve la lista (pesos, sesgos, activacion) que
+    usa ModeloNumpy. La BatchNormalization de inferencia es una transformacion afin
+    (escala * h + desplazamiento), asi que se pliega en los pesos de la capa densa que le sigue;
+    el Dropout no hace nada en inferencia y se omite.
+    :return: lista de capas para ModeloNumpy
+    """
+    capas = []
+    escala, desplazamiento = None, None
+    for layer in model.layers:
+        tipo = layer.__class__.__name__
+        if tipo in ("InputLayer", "Dropout"):
+            continue
+        elif tipo == "BatchNormalization":
+            media = np.asarray(layer.moving_mean, dtype=np.float64)
+            varianza = np.asarray(layer.moving_variance, dtype=np.float64)
+            gamma = np.ones_like(media) if layer.gamma is None else np.asarray(layer.gamma, dtype=np.float64)
+            beta = np.zeros_like(media) if layer.beta is None else np.asarray(layer.beta, dtype=np.float64)
+            escala_bn = gamma / np.sqrt(varianza + layer.epsilon)
+            desplazamiento_bn = beta - media * escala_bn
+            if escala is None:
+                escala, desplazamiento = escala_bn, desplazamiento_bn
+            else:
+                escala, desplazamiento = escala * escala_bn, desplazamiento * escala_bn + desplazamiento_bn
+        elif tipo == "Dense":
+            activacion = layer.get_config()["activation"]
+            # Una activacion que es una capa (p. ej. PReLU) llega serializada como diccionario
+            if not isinstance(activacion, str):
+                raise ValueError(f"Activacion no soportada por el motor NumPy: {activacion.get('class_name')}")
+            if activacion not in ACTIVACIONES:
+                raise ValueError(f"Activacion no soportada por el motor NumPy: {activacion}")
+            pesos = np.asarray(layer.kernel, dtype=np.float64)
+            sesgos = np.asarray(layer.bias, dtype=np.float64) if layer.use_bias else np.zeros(pesos.shape[1])
+            if escala is not None:
+                # W' = diag(escala) @ W  y  b' = desplazamiento @ W + b
+                sesgos = desplazamiento @ pesos + sesgos
+                pesos = escala[:, None] * pesos
+                escala, desplazamiento = None, None
+            capas.append((pesos.astype(np.float32), sesgos.astype(np.float32), activacion))
+        else:
+            raise ValueError(f"Capa no soportada por el motor NumPy: {tipo}")
+    if escala is not None:
+        raise ValueError("La red termina en BatchNormalization; no hay capa densa donde plegarla")
+    return capas
+
+
+def guardar_capas(capas, ruta):
+    arreglos = {"activaciones": np.array([activacion for _, _, activacion in capas])}
+    for i, (pesos, sesgos, _) in enumerate(capas):
+        arreglos[f"pesos_{i}"] = pesos
+        arreglos[f"sesgos_{i}"] = sesgos
+    np.savez(ruta, **arreglos)
+
+
+def verificar_paridad(model, modelo_numpy, n=2048, tolerancia=1e-3, semilla=42):
+    """
+    Compara model.predict contra el motor NumPy sobre vectores binarios aleatorios del tamaño de la entrada.
+    :return: maxima diferencia absoluta entre ambas predicciones
+    """
+    rng = np.random.default_rng(semilla)
+    x = rng.integers(0, 2, size=(n, model.input_shape[-1])).astype(np.float32)
+    esperado = model.predict(x, batch_size=512, verbose=0)
+    obtenido = modelo_numpy.predict(x)
+    diferencia = float(np.max(np.abs(esperado - obtenido)))
+    # Tolerancia relativa a la escala de los puntajes (cientos de puntos)
+    if diferencia > tolerancia * max(1.0, float(np.max(np.abs(esperado)))):
+        raise AssertionError(f"El motor NumPy no coincide con Keras (diferencia maxima {diferencia:.6f})")
+    return diferencia
+
+
+def exportar(ruta_modelo, ruta_salida):
+    """
+    Exporta los pesos y solo reemplaza ruta_salida si pasan la verificacion de paridad. Si el modelo no
+    se puede exportar o no pasa la verificacion se borra el .npz anterior, porque el tablero prediria
+    con el si existe aunque sea de otro modelo.
+    """
+    import keras
+
+    temporal = os.path.join(os.path.dirname(os.path.abspath(ruta_salida)), '_' + os.path.basename(ruta_salida))
+    try:
+        model = keras.models.load_model(ruta_modelo)
+        capas = plegar_capas(model)
+        guardar_capas(capas, temporal)
+        diferencia = verificar_paridad(model, ModeloNumpy.cargar(temporal))
+    except (ValueError, AssertionError):
+        for ruta in (temporal, ruta_salida):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        raise
+    os.replace(temporal, ruta_salida)
+    print(f"Pesos exportados a {ruta_salida} ({len(capas)} capas densas, diferencia maxima con Keras {diferencia:.2e})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exporta el modelo de Keras a pesos NumPy (.npz) para el tablero')
+    parser.add_argument('--modelo', '-m', type=str, default='modelo_proyecto3.keras')
+    parser.add_argument('--salida', '-o', type=str, default='modelo_proyecto3.npz')
+    args = parser.parse_args()
+    try:
+        exportar(args.modelo, args.salida)
+    except (ValueError, AssertionError) as error:
+        print(error)
+        sys.exit(1)
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from Limpieza import COLUMNAS_CATEGORICAS, limpiar_archivo
+
+# Los datos limpios se guardan como un directorio con una carpeta por periodo
+# (datos_limpios/20221/parte-000.parquet, ...). pd.read_parquet lee el directorio completo como una
+# sola tabla y los archivos de control empiezan con _ para que esa lectura los ignore.
+ARCHIVO_HUELLAS = '_huellas.npy'
+ARCHIVO_CATALOGOS = '_catalogos.json'
+# Partes de una carga que ya tienen su nombre definitivo pero aun no estan confirmadas (ver ingerir)
+ARCHIVO_CARGA = '_carga.json'
+HUELLAS_NUEVAS = '_huellas_nuevas.npy'
+CATALOGOS_NUEVOS = '_catalogos_nuevos.json'
+
+
+def escribir_particiones(tabla, directorio):
+    """
+    Escribe las filas de cada periodo como una parte nueva en la carpeta de ese periodo, sin tocar las
+    partes que ya existian. Las partes quedan con un nombre temporal (empieza con _, asi la lectura
+    del directorio no las ve) hasta que ingerir las renombra todas juntas.
+    :return: diccionario periodo -> filas agregadas, y lista de (ruta temporal, ruta definitiva)
+    """
+    filas, renombres = {}, []
+    for periodo in sorted(pc.unique(tabla['periodo']).to_pylist()):
+        filas_periodo = tabla.filter(pc.equal(tabla['periodo'], periodo))
+        carpeta = os.path.join(directorio, str(periodo))
+        os.makedirs(carpeta, exist_ok=True)
+        parte = len([nombre for nombre in os.listdir(carpeta) if nombre.startswith('parte-')])
+        temporal = os.path.join(carpeta, f'_parte-{parte:03d}.parquet')
+        pq.write_table(filas_periodo, temporal)
+        renombres.append((temporal, os.path.join(carpeta, f'parte-{parte:03d}.parquet')))
+        filas[periodo] = filas_periodo.num_rows
+    return filas, renombres
+
+
+def leer_catalogos(directorio):
+    """
+    Catalogo de categorias conocidas de cada variable, que ingerir actualiza con cada carga: sirve de
+    codificador sin recorrer los datos (ver Modelo_Lineal.py).
+    :return: diccionario variable -> lista de categorias, o None si el directorio no tiene catalogo
+    """
+    ruta = os.path.join(directorio, ARCHIVO_CATALOGOS)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def actualizar_catalogos(tabla, directorio, ruta_salida):
+    """
+    Agrega al catalogo del directorio las categorias que aparecen en las filas nuevas y lo escribe en
+    ruta_salida; ingerir lo pone en su lugar al confirmar la carga.
+    :return: diccionario variable -> categorias que no estaban en el catalogo
+    """
+    catalogos = leer_catalogos(directorio) or {}
+    nuevas = {}
+    for columna in COLUMNAS_CATEGORICAS:
+        conocidas = set(catalogos.get(columna, []))
+        valores = set(pc.unique(tabla[columna].cast(pa.string())).to_pylist()) - {None}
+        if valores - conocidas:
+            nuevas[columna] = sorted(valores - conocidas)
+            catalogos[columna] = sorted(conocidas | valores)
+
+    with open(ruta_salida, 'w', encoding='utf-8') as archivo:
+        json.dump(catalogos, archivo, ensure_ascii=False, indent=2)
+    return nuevas
+
+
+def deshacer_carga_incompleta(directorio):
+    """
+    Limpia lo que haya dejado una carga interrumpida. Si alcanzo a renombrar partes pero no a
+    confirmarse (las huellas nuevas siguen sin reemplazar a las anteriores) esas partes se borran: las
+    huellas no las cuentan como cargadas y la siguiente carga las volveria a agregar.
+    :return: cantidad de partes borradas
+    """
+    ruta_carga = os.path.join(directorio, ARCHIVO_CARGA)
+    huellas_nuevas = os.path.join(directorio, HUELLAS_NUEVAS)
+    borradas = 0
+    if os.path.exists(ruta_carga):
+        with open(ruta_carga, encoding='utf-8') as archivo:
+            partes = json.load(archivo)
+        if os.path.exists(huellas_nuevas):
+            for parte in partes:
+                if os.path.exists(parte):
+                    os.remove(parte)
+                    borradas += 1
+        os.remove(ruta_carga)
+
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            if nombre.startswith('_parte-'):
+                os.remove(os.path.join(raiz, nombre))
+    for nombre in (HUELLAS_NUEVAS, CATALOGOS_NUEVOS, '_nuevo.parquet'):
+        if os.path.exists(os.path.join(directorio, nombre)):
+            os.remove(os.path.join(directorio, nombre))
+    return borradas
+
+
+def ingerir(ruta_entrada, directorio, tamano_bloque=100_000):
+    """
+    Limpia un archivo crudo nuevo (normalmente la publicacion de un periodo) y lo agrega al directorio
+    de datos limpios: solo se procesan las filas del archivo nuevo, las ya cargadas se descartan con
+    las huellas guardadas y no se reescribe ningun periodo anterior.
+    :return: diccionario periodo -> filas agregadas, categorias nuevas por variable y partes borradas
+             de una carga anterior interrumpida
+    """
+    os.makedirs(directorio, exist_ok=True)
+    borradas = deshacer_carga_incompleta(directorio)
+    ruta_huellas = os.path.join(directorio, ARCHIVO_HUELLAS)
+    ruta_nuevo = os.path.join(directorio, '_nuevo.parquet')
+    ruta_carga = os.path.join(directorio, ARCHIVO_CARGA)
+    # Las huellas y el catalogo de esta carga se guardan aparte y reemplazan a los anteriores solo
+    # cuando todas las particiones ya estan escritas
+    huellas_nuevas = os.path.join(directorio, HUELLAS_NUEVAS)
+    catalogos_nuevos = os.path.join(directorio, CATALOGOS_NUEVOS)
+    if os.path.exists(ruta_huellas):
+        shutil.copyfile(ruta_huellas, huellas_nuevas)
+
+    limpiar_archivo(ruta_entrada, ruta_nuevo, tamano_bloque, huellas_nuevas)
+    tabla = pq.read_table(ruta_nuevo)
+    filas, renombres = escribir_particiones(tabla, directorio)
+    nuevas = actualizar_catalogos(tabla, directorio, catalogos_nuevos)
+
+    # Se registran las partes antes de darles su nombre definitivo: si la carga se interrumpe antes de
+    # reemplazar las huellas, la siguiente las borra (ver deshacer_carga_incompleta)
+    temporal = os.path.join(directorio, '_carga_nueva.json')
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump([definitiva for _, definitiva in renombres], archivo)
+    os.replace(temporal, ruta_carga)
+    for temporal, definitiva in renombres:
+        os.replace(temporal, definitiva)
+
+    # Confirmacion: reemplazar las huellas es lo que da la carga por hecha. Si se interrumpe justo
+    # antes, el catalogo queda con categorias de mas, que no cambian ninguna fila
+    os.replace(catalogos_nuevos, os.path.join(directorio, ARCHIVO_CATALOGOS))
+    os.replace(huellas_nuevas, ruta_huellas)
+    os.remove(ruta_carga)
+    os.remove(ruta_nuevo)
+    return filas, nuevas, borradas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Limpia y agrega un periodo nuevo del Saber 11 a los datos limpios particionados')
+    parser.add_argument('--entrada', '-i', type=str, required=True, help='archivo crudo del periodo nuevo')
+    parser.add_argument('--datos', '-o', type=str, default='datos_limpios')
+    parser.add_argument('--tamano_bloque', '-c', type=int, default=100_000)
+    args = parser.parse_args()
+
+    filas, nuevas, borradas = ingerir(args.entrada, args.datos, args.tamano_bloque)
+    if borradas:
+        print(f"Se borraron {borradas} partes de una carga anterior que no se completo")
+    for periodo, cantidad in filas.items():
+        print(f"Periodo {periodo}: {cantidad} filas agregadas")
+    if not filas:
+        print("No hay filas nuevas")
+    for columna, categorias in nuevas.items():
+        print(f"Categorias nuevas en {columna}: {', '.join(categorias)}")
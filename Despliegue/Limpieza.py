@@ -0,0 +1,205 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Mismos pasos de Limpieza.ipynb, pero leyendo el archivo crudo por bloques para poder procesar
+# extractos nacionales del Saber 11 sin cargarlos completos en memoria
+
+# Columnas que se conservan del archivo crudo (el notebook eliminaba las otras 24 y cole_bilingue)
+COLUMNAS_CATEGORICAS = ['cole_area_ubicacion', 'cole_caracter', 'cole_genero', 'cole_jornada', 'cole_mcpio_ubicacion',
+                        'cole_naturaleza', 'estu_genero', 'estu_mcpio_presentacion', 'estu_mcpio_reside',
+                        'fami_cuartoshogar', 'fami_educacionmadre', 'fami_educacionpadre', 'fami_estratovivienda',
+                        'fami_personashogar', 'fami_tieneautomovil', 'fami_tienecomputador', 'fami_tieneinternet',
+                        'fami_tienelavadora', 'desemp_ingles']
+COLUMNAS_PUNTAJE = ['punt_ingles', 'punt_matematicas', 'punt_sociales_ciudadanas', 'punt_c_naturales',
+                    'punt_lectura_critica', 'punt_global']
+COLUMNAS_LIMPIAS = ['periodo'] + COLUMNAS_CATEGORICAS + COLUMNAS_PUNTAJE
+
+MAPA_PERSONAS_HOGAR = {
+    'Una': '1 a 2',
+    'Dos': '1 a 2',
+    '1 a 2': '1 a 2',
+    'Tres': '3 a 4',
+    'Cuatro': '3 a 4',
+    '3 a 4': '3 a 4',
+    'Cinco': '5 a 6',
+    'Seis': '5 a 6',
+    '5 a 6': '5 a 6',
+    'Siete': '7 a 8',
+    'Ocho': '7 a 8',
+    '7 a 8': '7 a 8',
+    'Nueve': '9 o mas',
+    '9 o mas': '9 o mas',
+    'Diez': '9 o mas',
+    'Once': '9 o mas',
+    'Doce o mas': '9 o mas'
+}
+
+MAPA_CUARTOS_HOGAR = {
+    'Uno': '1',
+    'Dos': '2',
+    'Tres': '3',
+    'Cuatro': '4',
+    'Cinco': '5',
+    'Seis': '6 o mas',
+    'Siete': '6 o mas',
+    'Ocho': '6 o mas',
+    'Nueve': '6 o mas',
+    'Seis o mas': '6 o mas',
+    'Diez o mas': '6 o mas'
+}
+
+# Esquema fijo del Parquet de salida: todos los bloques se escriben con los mismos tipos
+ESQUEMA_SALIDA = pa.schema(
+    [pa.field('periodo', pa.int32())]
+    + [pa.field(columna, pa.dictionary(pa.int32(), pa.string())) for columna in COLUMNAS_CATEGORICAS]
+    + [pa.field(columna, pa.int16()) for columna in COLUMNAS_PUNTAJE]
+)
+
+
+class HuellasVistas:
+    """
+    Huellas (hash de 64 bits) de las filas ya vistas, en arreglos ordenados de uint64: 8 bytes por
+    fila en vez de un set de enteros de Python. Las huellas nuevas se acumulan en arreglos pequeños
+    que se fusionan cuando crecen, para no reordenar todo con cada bloque.
+    """
+
+    def __init__(self):
+        self.ordenadas = np.empty(0, dtype=np.uint64)
+        self.pendientes = []
+
+    def contiene(self, huellas):
+        """
+        :return: arreglo booleano, True para las huellas que ya se habian visto
+        """
+        vistas = np.zeros(len(huellas), dtype=bool)
+        for arreglo in [self.ordenadas] + self.pendientes:
+            if len(arreglo):
+                posiciones = np.minimum(np.searchsorted(arreglo, huellas), len(arreglo) - 1)
+                vistas |= arreglo[posiciones] == huellas
+        return vistas
+
+    def agregar(self, huellas):
+        self.pendientes.append(np.sort(huellas))
+        if sum(len(arreglo) for arreglo in self.pendientes) > len(self.ordenadas) or len(self.pendientes) > 16:
+            self.ordenadas = np.sort(np.concatenate([self.ordenadas] + self.pendientes))
+            self.pendientes = []
+
+    def __len__(self):
+        return len(self.ordenadas) + sum(len(arreglo) for arreglo in self.pendientes)
+
+    def guardar(self, ruta):
+        """
+        Guarda todas las huellas en un .npy. Se escribe a un temporal y luego se reemplaza, para que
+        una carga interrumpida no deje un archivo de huellas a medias.
+        """
+        self.ordenadas = np.sort(np.concatenate([self.ordenadas] + self.pendientes))
+        self.pendientes = []
+        temporal = ruta + '.tmp'
+        with open(temporal, 'wb') as archivo:
+            np.save(archivo, self.ordenadas)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """
+        :return: HuellasVistas con las huellas guardadas en ruta, o vacia si el archivo no existe
+        """
+        vistas = cls()
+        if os.path.exists(ruta):
+            vistas.ordenadas = np.load(ruta)
+        return vistas
+
+
+def quitar_tildes(serie, memoria):
+    """
+    Quita tildes y caracteres especiales (NFKD a ascii) como en el notebook, pero normalizando solo los
+    valores distintos que aun no estan en memoria (diccionario valor original -> valor normalizado,
+    compartido entre bloques). Las columnas tienen decenas de valores distintos, no millones.
+    :return: serie normalizada
+    """
+    # codigos: posicion de cada fila en unicos (-1 para faltantes)
+    codigos, unicos = pd.factorize(serie)
+    nuevos = [valor for valor in unicos if valor not in memoria]
+    if nuevos:
+        normalizados = pd.Series(nuevos, dtype=object).str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
+        memoria.update(zip(nuevos, normalizados))
+    # El faltante va al final para que el codigo -1 lo tome
+    tabla = np.array([memoria[valor] for valor in unicos] + [np.nan], dtype=object)
+    return pd.Series(tabla[codigos], index=serie.index, dtype=serie.dtype)
+
+
+def limpiar_bloque(bloque, vistas, memorias):
+    """
+    Aplica a un bloque del archivo crudo los filtros y mapeos del notebook. vistas guarda las huellas
+    de las filas de bloques anteriores, para eliminar duplicados entre bloques, y memorias los valores
+    ya normalizados de cada columna de texto.
+    :return: DataFrame limpio con las columnas de COLUMNAS_LIMPIAS
+    """
+    # Duplicados, dentro del bloque y contra los bloques (o cargas) anteriores. Las columnas se
+    # ordenan antes del hash para que la huella no dependa del orden de columnas del archivo crudo
+    bloque = bloque[COLUMNAS_LIMPIAS]
+    huellas = pd.util.hash_pandas_object(bloque, index=False).to_numpy()
+    nuevas = ~pd.Series(huellas).duplicated().to_numpy() & ~vistas.contiene(huellas)
+    vistas.agregar(huellas[nuevas])
+
+    # Registros sin puntaje global y luego cualquier faltante
+    bloque = bloque[nuevas]
+    bloque = bloque[bloque['punt_global'].notna()].dropna().copy()
+
+    # Quitar tildes y caracteres especiales de las columnas de texto
+    for columna in COLUMNAS_CATEGORICAS:
+        bloque[columna] = quitar_tildes(bloque[columna], memorias.setdefault(columna, {}))
+
+    bloque['fami_personashogar'] = bloque['fami_personashogar'].replace(MAPA_PERSONAS_HOGAR)
+    bloque['fami_cuartoshogar'] = bloque['fami_cuartoshogar'].replace(MAPA_CUARTOS_HOGAR)
+
+    # Puntajes en cero. El notebook tambien intentaba quitar punt_global == 500, pero por la precedencia
+    # de | esa condicion nunca se cumplia; aqui se conserva el comportamiento real (solo ceros)
+    ceros = (bloque[COLUMNAS_PUNTAJE] == 0).any(axis=1)
+    bloque = bloque[~ceros]
+
+    return bloque[COLUMNAS_LIMPIAS].astype({'periodo': 'int32'} | {columna: 'int16' for columna in COLUMNAS_PUNTAJE})
+
+
+def limpiar_archivo(ruta_entrada, ruta_salida, tamano_bloque=100_000, ruta_huellas=None):
+    """
+    Limpia el archivo crudo bloque a bloque y va agregando cada bloque limpio al Parquet de salida.
+    Con ruta_huellas se descartan tambien las filas ya vistas en cargas anteriores y, al terminar,
+    se guardan las huellas de esta carga: la salida tiene solo las filas nuevas, para ponerla junto
+    a los Parquet anteriores sin volver a revisar la tabla completa.
+    :return: numero de filas escritas
+    """
+    # Tipos fijos para todos los bloques: las categoricas como texto (un bloque con solo '1', '2'... no
+    # debe volverse numerico) y los numeros como float (un bloque con faltantes no debe cambiar de
+    # tipo), asi las huellas de filas iguales coinciden entre bloques
+    tipos = {columna: str for columna in COLUMNAS_CATEGORICAS} | {columna: 'float64' for columna in ['periodo'] + COLUMNAS_PUNTAJE}
+    vistas = HuellasVistas.cargar(ruta_huellas) if ruta_huellas else HuellasVistas()
+    memorias = {}
+    filas = 0
+    with pq.ParquetWriter(ruta_salida, ESQUEMA_SALIDA) as escritor:
+        for bloque in pd.read_csv(ruta_entrada, usecols=COLUMNAS_LIMPIAS, dtype=tipos, chunksize=tamano_bloque):
+            limpio = limpiar_bloque(bloque, vistas, memorias)
+            escritor.write_table(pa.Table.from_pandas(limpio, schema=ESQUEMA_SALIDA, preserve_index=False))
+            filas += len(limpio)
+    # Las huellas se guardan solo si la salida quedo completa
+    if ruta_huellas:
+        vistas.guardar(ruta_huellas)
+    return filas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Limpieza por bloques de los resultados crudos del Saber 11')
+    parser.add_argument('--entrada', '-i', type=str, default='datos_norte_santander.csv')
+    parser.add_argument('--salida', '-o', type=str, default='datos_limpios.parquet')
+    parser.add_argument('--tamano_bloque', '-c', type=int, default=100_000)
+    parser.add_argument('--huellas', type=str, default=None,
+                        help='archivo .npy con las huellas de cargas anteriores (se actualiza al terminar)')
+    args = parser.parse_args()
+
+    filas = limpiar_archivo(args.entrada, args.salida, args.tamano_bloque, args.huellas)
+    print(f"{filas} filas limpias escritas en {args.salida}")
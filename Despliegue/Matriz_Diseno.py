@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Variables categoricas del modelo, en el orden en que se codifican con get_dummies
+COLUMNAS_CATEGORICAS = ['cole_area_ubicacion', 'cole_caracter', 'cole_genero', 'cole_jornada', 'cole_mcpio_ubicacion',
+                        'cole_naturaleza', 'estu_genero', 'estu_mcpio_presentacion', 'estu_mcpio_reside',
+                        'fami_cuartoshogar', 'fami_educacionmadre', 'fami_educacionpadre', 'fami_estratovivienda',
+                        'fami_personashogar', 'fami_tieneautomovil', 'fami_tienecomputador', 'fami_tieneinternet',
+                        'fami_tienelavadora', 'desemp_ingles']
+
+
+def construir_matriz(ruta_datos, columnas_categoricas=COLUMNAS_CATEGORICAS):
+    """
+    Codifica los datos limpios con get_dummies(drop_first=True) directamente en uint8 (0/1 no necesita
+    los 8 bytes de int64) y arma el esquema de codificacion: categorias de cada variable (en el orden
+    que usa get_dummies), la categoria base que elimina drop_first y el orden final de las columnas.
+    :return: (matriz x uint8, objetivo y, esquema)
+    """
+    data_completa = pd.read_parquet(ruta_datos, columns=columnas_categoricas + ['punt_global'])
+    # Categorias en orden alfabetico, como las ordena get_dummies sobre texto: la categoria base de
+    # drop_first no debe depender del orden en que aparecieron al escribir el Parquet por bloques
+    for columna in columnas_categoricas:
+        categorica = data_completa[columna].astype('category')
+        data_completa[columna] = categorica.cat.reorder_categories(sorted(categorica.cat.categories))
+
+    data_x = pd.get_dummies(data_completa[columnas_categoricas], columns=columnas_categoricas, drop_first=True,
+                            dtype=np.uint8)
+    data_y = data_completa['punt_global'].to_numpy(dtype=np.float32)
+
+    esquema = {"variables": {}, "columnas": list(data_x.columns)}
+    for columna in columnas_categoricas:
+        categorias = [str(categoria) for categoria in pd.Categorical(data_completa[columna]).categories]
+        esquema["variables"][columna] = {"categorias": categorias, "base": categorias[0]}
+
+    return data_x.to_numpy(dtype=np.uint8), data_y, esquema
+
+
+def comprimir_matriz(data_x, data_y):
+    """
+    Agrupa las filas repetidas de la matriz one-hot (estudiantes con el mismo perfil en todas las
+    variables) y guarda por perfil la cantidad de estudiantes y la media y la varianza de su puntaje.
+    Las filas se empaquetan en bits (148 columnas -> 19 bytes) antes de buscar las repetidas.
+    :return: (perfiles uint8, conteos, medias, varianzas)
+    """
+    empaquetadas = np.ascontiguousarray(np.packbits(data_x, axis=1))
+    _, primeras, grupos, conteos = np.unique(empaquetadas.view(np.dtype((np.void, empaquetadas.shape[1]))).ravel(),
+                                             return_index=True, return_inverse=True, return_counts=True)
+    y = np.asarray(data_y, dtype=np.float64)
+    medias = np.bincount(grupos, weights=y) / conteos
+    varianzas = np.maximum(np.bincount(grupos, weights=y * y) / conteos - medias ** 2, 0)
+    return np.asarray(data_x[primeras]), conteos, medias.astype(np.float32), varianzas.astype(np.float32)
+
+
+def huella_origen(ruta_datos):
+    """
+    Tamaño y fecha de modificacion del Parquet de origen o, si son los datos particionados por periodo
+    (ver Ingerir_Periodo.py), de cada una de sus partes: agregar un periodo cambia la huella.
+    :return: lista JSON con la huella
+    """
+    if not os.path.isdir(ruta_datos):
+        return [os.path.getsize(ruta_datos), os.path.getmtime(ruta_datos)]
+    partes = []
+    for raiz, _, nombres in os.walk(ruta_datos):
+        for nombre in nombres:
+            if nombre.endswith('.parquet') and not nombre.startswith(('_', '.')):
+                ruta = os.path.join(raiz, nombre)
+                partes.append([os.path.relpath(ruta, ruta_datos), os.path.getsize(ruta), os.path.getmtime(ruta)])
+    return sorted(partes)
+
+
+def guardar_esquema(esquema, ruta):
+    """
+    Escribe el esquema de codificacion como lo lee el tablero (esquema_modelo.json junto al modelo).
+    """
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(esquema, archivo, ensure_ascii=False, indent=2)
+
+
+def entradas_modelo(ruta_modelo):
+    """
+    Ancho de la entrada de un modelo .keras, leido de su config.json sin cargar Keras (los modelos
+    guardados con Keras 2 no se pueden cargar con Keras 3 y viceversa).
+    :return: cantidad de columnas que espera el modelo
+    """
+    with zipfile.ZipFile(ruta_modelo) as archivo:
+        config = json.loads(archivo.read('config.json'))
+    for capa in config['config']['layers']:
+        if capa['class_name'] == 'InputLayer':
+            return capa['config'].get('batch_shape', capa['config'].get('batch_input_shape'))[-1]
+    raise ValueError(f"{ruta_modelo} no tiene capa de entrada")
+
+
+def cargar_matriz(ruta_datos, columnas_categoricas=COLUMNAS_CATEGORICAS, directorio='cache_matriz'):
+    """
+    Devuelve la matriz de diseño guardada en directorio (.npy abiertos con mmap, sin volver a codificar)
+    o la construye y la guarda si no existe o si los datos cambiaron desde la ultima vez.
+    :return: (matriz x uint8, objetivo y, esquema)
+    """
+    ruta_x = os.path.join(directorio, 'data_x.npy')
+    ruta_y = os.path.join(directorio, 'data_y.npy')
+    ruta_esquema = os.path.join(directorio, 'esquema.json')
+    # Huella de los datos de origen: si cambian, la matriz guardada ya no sirve
+    origen = {"ruta": os.path.abspath(ruta_datos), "archivos": huella_origen(ruta_datos),
+              "columnas": columnas_categoricas}
+
+    if os.path.exists(ruta_esquema):
+        with open(ruta_esquema, encoding='utf-8') as archivo:
+            guardado = json.load(archivo)
+        if guardado.get("origen") == origen and os.path.exists(ruta_x) and os.path.exists(ruta_y):
+            return np.load(ruta_x, mmap_mode='r'), np.load(ruta_y, mmap_mode='r'), guardado["esquema"]
+
+    data_x, data_y, esquema = construir_matriz(ruta_datos, columnas_categoricas)
+    os.makedirs(directorio, exist_ok=True)
+    np.save(ruta_x, data_x)
+    np.save(ruta_y, data_y)
+    # El esquema se escribe al final: si se interrumpe antes, la siguiente corrida reconstruye todo
+    with open(ruta_esquema, 'w', encoding='utf-8') as archivo:
+        json.dump({"origen": origen, "esquema": esquema}, archivo, ensure_ascii=False, indent=2)
+    return np.load(ruta_x, mmap_mode='r'), np.load(ruta_y, mmap_mode='r'), esquema
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precalcula la matriz de diseño one-hot (uint8) para el entrenamiento')
+    parser.add_argument('--datos', '-i', type=str, default='datos_limpios')
+    parser.add_argument('--directorio', '-o', type=str, default='cache_matriz')
+    parser.add_argument('--comprimir', type=int, default=0, help='1 para contar los perfiles distintos (ver Entrenar_Modelo.py --comprimir)')
+    parser.add_argument('--esquema', type=str, default=None,
+                        help='escribe aqui el esquema para el tablero (p. ej. esquema_modelo.json) sin entrenar')
+    parser.add_argument('--modelo', type=str, default=None,
+                        help='con --esquema, modelo .keras cuya entrada debe coincidir con las columnas del esquema')
+    args = parser.parse_args()
+
+    data_x, data_y, esquema = cargar_matriz(args.datos, directorio=args.directorio)
+    print(f"Matriz de diseño {data_x.shape} ({data_x.nbytes / 1e6:.1f} MB) en {args.directorio}")
+    if args.esquema:
+        if args.modelo:
+            # El esquema sale de los datos actuales: si trajeron categorias nuevas ya no sirve para el modelo
+            entradas = entradas_modelo(args.modelo)
+            if entradas != len(esquema["columnas"]):
+                raise SystemExit(f"El modelo espera {entradas} columnas y el esquema de {args.datos} tiene "
+                                 f"{len(esquema['columnas'])}: los datos no son los del entrenamiento")
+        guardar_esquema(esquema, args.esquema)
+        print(f"Esquema de {len(esquema['columnas'])} columnas en {args.esquema}")
+    if args.comprimir:
+        perfiles, conteos, medias, varianzas = comprimir_matriz(data_x, data_y)
+        # La dispersion dentro de cada perfil es el error que ningun modelo con estas variables puede quitar
+        print(f"{len(perfiles)} perfiles distintos ({len(perfiles) / len(data_x):.1%} de las filas); "
+              f"desviacion del puntaje dentro de un perfil: {np.sqrt(np.average(varianzas, weights=conteos)):.2f}")
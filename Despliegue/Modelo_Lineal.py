@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from Exportar_Modelo import guardar_capas
+from Ingerir_Periodo import leer_catalogos
+from Matriz_Diseno import COLUMNAS_CATEGORICAS, huella_origen
+
+# Linea base de regresion ridge sobre la matriz one-hot. Todo lo que necesita el ajuste son las
+# sumas X'X (149 x 149 con el intercepto), X'y, y'y y la cantidad de filas, que se acumulan en una sola
+# pasada por bloques y se pueden sumar: agregar un periodo es acumular sus filas y volver a resolver
+# las ecuaciones normales, sin recorrer los periodos anteriores. El modelo resultante es una sola capa
+# lineal en el formato de Exportar_Modelo.py, asi que el tablero lo sirve con ModeloNumpy
+
+
+def acumular_gram(x, y, estadisticos=None, tamano_bloque=32_768, conteos=None, varianzas=None):
+    """
+    Suma a estadisticos (o a unos nuevos) X'X, X'y, y'y y n de las filas de x (uint8) y y, con una
+    columna de unos al final para el intercepto. X'X se calcula en float32 por bloque (con 0/1 los
+    conteos de un bloque son enteros exactos) y se acumula en float64; X'y se calcula en float64.
+    Con los perfiles de Matriz_Diseno.comprimir_matriz (y son las medias) cada fila pesa su conteo y
+    las sumas son las mismas que con las filas originales.
+    :return: diccionario con xtx, xty, yty y n
+    """
+    columnas = x.shape[1] + 1
+    if estadisticos is None:
+        estadisticos = {"xtx": np.zeros((columnas, columnas)), "xty": np.zeros(columnas), "yty": 0.0, "n": 0}
+    bloque = np.ones((min(tamano_bloque, len(x)), columnas), dtype=np.float32)
+    for inicio in range(0, len(x), tamano_bloque):
+        filas = min(tamano_bloque, len(x) - inicio)
+        xb = bloque[:filas]
+        xb[:, :-1] = x[inicio:inicio + filas]
+        yb = np.asarray(y[inicio:inicio + filas], dtype=np.float64)
+        if conteos is None:
+            estadisticos["xtx"] += xb.T @ xb
+            estadisticos["xty"] += yb @ xb
+            estadisticos["yty"] += float(yb @ yb)
+            estadisticos["n"] += filas
+        else:
+            cb = np.asarray(conteos[inicio:inicio + filas], dtype=np.float64)
+            estadisticos["xtx"] += xb.T @ (xb * cb[:, None])
+            estadisticos["xty"] += (cb * yb) @ xb
+            # sum(y^2) de cada perfil = conteo * (media^2 + varianza)
+            estadisticos["yty"] += float(cb @ (yb * yb + varianzas[inicio:inicio + filas]))
+            estadisticos["n"] += int(cb.sum())
+    return estadisticos
+
+
+def resolver_ridge(estadisticos, alfa=1.0):
+    """
+    Resuelve las ecuaciones normales (X'X + alfa I) w = X'y sin penalizar el intercepto.
+    :return: (pesos de cada columna one-hot, intercepto)
+    """
+    matriz = estadisticos["xtx"].copy()
+    indices = np.arange(len(matriz) - 1)
+    matriz[indices, indices] += alfa
+    # lstsq en vez de solve: con alfa=0 una categoria sin filas deja la matriz singular
+    solucion = np.linalg.lstsq(matriz, estadisticos["xty"], rcond=None)[0]
+    return solucion[:-1], float(solucion[-1])
+
+
+def predecir_lineal(pesos, intercepto, x, tamano_bloque=262_144):
+    """
+    :return: arreglo 1D con x @ pesos + intercepto, calculado por bloques sobre la matriz uint8
+    """
+    pesos = pesos.astype(np.float32)
+    return np.concatenate([x[inicio:inicio + tamano_bloque].astype(np.float32) @ pesos + intercepto
+                           for inicio in range(0, len(x), tamano_bloque)])
+
+
+def guardar_lineal(pesos, intercepto, ruta):
+    """
+    Guarda el modelo como una capa densa lineal de ModeloNumpy (ver Exportar_Modelo.py).
+    """
+    guardar_capas([(pesos.astype(np.float32)[:, None], np.array([intercepto], dtype=np.float32), "linear")], ruta)
+
+
+def esquema_de_categorias(categorias):
+    """
+    Esquema de codificacion con el formato de Matriz_Diseno.py a partir de las categorias de cada
+    variable: ordenadas alfabeticamente, la primera es la base y las demas son columnas one-hot.
+    :return: esquema
+    """
+    esquema = {"variables": {}, "columnas": []}
+    for columna in COLUMNAS_CATEGORICAS:
+        ordenadas = sorted(categorias[columna])
+        esquema["variables"][columna] = {"categorias": ordenadas, "base": ordenadas[0]}
+        esquema["columnas"] += [f"{columna}_{categoria}" for categoria in ordenadas[1:]]
+    return esquema
+
+
+def codificar(tabla, esquema):
+    """
+    Codifica un DataFrame de datos limpios con un esquema fijo, con las mismas columnas y en el mismo
+    orden que get_dummies(drop_first=True) en Matriz_Diseno.py.
+    :return: (matriz x uint8, objetivo y)
+    """
+    x = np.zeros((len(tabla), len(esquema["columnas"])), dtype=np.uint8)
+    inicio = 0
+    for columna, variable in esquema["variables"].items():
+        codigos = pd.Categorical(tabla[columna], categories=variable["categorias"]).codes.astype(np.intp)
+        if ((codigos < 0) & tabla[columna].notna().to_numpy()).any():
+            raise ValueError(f"Hay categorias de {columna} que no estan en el esquema")
+        filas = np.flatnonzero(codigos > 0)
+        x[filas, inicio + codigos[filas] - 1] = 1
+        inicio += len(variable["categorias"]) - 1
+    return x, tabla['punt_global'].to_numpy(dtype=np.float32)
+
+
+def cargar_estadisticos(ruta):
+    """
+    :return: (estadisticos, partes ya acumuladas, esquema), o (None, {}, None) si no hay archivo
+    """
+    if not os.path.exists(ruta):
+        return None, {}, None
+    with np.load(ruta) as archivo:
+        estadisticos = {"xtx": archivo["xtx"], "xty": archivo["xty"], "yty": float(archivo["yty"]), "n": int(archivo["n"])}
+        metadatos = json.loads(str(archivo["metadatos"]))
+    return estadisticos, metadatos["partes"], metadatos["esquema"]
+
+
+def guardar_estadisticos(estadisticos, partes, esquema, ruta):
+    # Se escribe con otro nombre y se renombra, para no dejar un archivo a medias
+    temporal = os.path.join(os.path.dirname(os.path.abspath(ruta)), '_estadisticos_nuevos.npz')
+    with open(temporal, 'wb') as archivo:
+        np.savez(archivo, xtx=estadisticos["xtx"], xty=estadisticos["xty"], yty=estadisticos["yty"], n=estadisticos["n"],
+                 metadatos=json.dumps({"partes": partes, "esquema": esquema}, ensure_ascii=False))
+    os.replace(temporal, ruta)
+
+
+def categorias_partes(ruta_datos, relativas, categorias=None):
+    """
+    Agrega a categorias las que aparecen en las partes, leyendo solo las columnas categoricas de una
+    parte a la vez.
+    :return: diccionario variable -> conjunto de categorias
+    """
+    categorias = categorias or {columna: set() for columna in COLUMNAS_CATEGORICAS}
+    for relativa in relativas:
+        tabla = pq.read_table(os.path.join(ruta_datos, relativa), columns=COLUMNAS_CATEGORICAS)
+        for columna in COLUMNAS_CATEGORICAS:
+            categorias[columna] |= set(pc.unique(tabla[columna].cast(pa.string())).to_pylist()) - {None}
+    return categorias
+
+
+def actualizar_estadisticos(ruta_datos, ruta_estadisticos, tamano_bloque=32_768):
+    """
+    Acumula en el archivo de estadisticos las partes de datos_limpios (ver Ingerir_Periodo.py) que aun
+    no estan incluidas; un solo archivo Parquet cuenta como una parte. Si una parte ya incluida cambio o
+    desaparecio, o si aparecen categorias nuevas (cambian las columnas one-hot), se vuelve a acumular todo. Las categorias salen del catalogo que
+    mantiene Ingerir_Periodo.py; sin catalogo se recorren las partes. Despues se codifica y acumula una
+    parte a la vez, asi en memoria nunca hay mas de una parte.
+    :return: (estadisticos, esquema, cantidad de partes acumuladas en esta corrida)
+    """
+    estadisticos, incluidas, esquema = cargar_estadisticos(ruta_estadisticos)
+    if os.path.isdir(ruta_datos):
+        directorio = ruta_datos
+        partes = {relativa: [tamano, fecha] for relativa, tamano, fecha in huella_origen(ruta_datos)}
+        catalogos = leer_catalogos(ruta_datos)
+    else:
+        # Un solo Parquet (datos_limpios.parquet de Limpieza.py) es una sola parte, sin catalogo
+        directorio = os.path.dirname(ruta_datos)
+        partes = {os.path.basename(ruta_datos): huella_origen(ruta_datos)}
+        catalogos = None
+    nuevas = [relativa for relativa in partes if relativa not in incluidas]
+
+    reconstruir = estadisticos is None or any(partes.get(relativa) != huella for relativa, huella in incluidas.items())
+    if catalogos is not None:
+        esquema_nuevo = esquema_de_categorias({columna: set(catalogos.get(columna, [])) for columna in COLUMNAS_CATEGORICAS})
+        reconstruir = reconstruir or esquema_nuevo != esquema
+    elif not reconstruir:
+        conocidas = {columna: set(variable["categorias"]) for columna, variable in esquema["variables"].items()}
+        esquema_nuevo = esquema_de_categorias(categorias_partes(directorio, nuevas, conocidas))
+        reconstruir = esquema_nuevo != esquema
+    if reconstruir:
+        estadisticos, incluidas, nuevas = None, {}, list(partes)
+        esquema = esquema_nuevo if catalogos is not None else esquema_de_categorias(categorias_partes(directorio, nuevas))
+
+    for relativa in nuevas:
+        tabla = pd.read_parquet(os.path.join(directorio, relativa), columns=COLUMNAS_CATEGORICAS + ['punt_global'])
+        x, y = codificar(tabla, esquema)
+        estadisticos = acumular_gram(x, y, estadisticos, tamano_bloque)
+        incluidas[relativa] = partes[relativa]
+        del tabla, x, y
+
+    guardar_estadisticos(estadisticos, incluidas, esquema, ruta_estadisticos)
+    return estadisticos, esquema, len(nuevas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ajusta (o actualiza con los periodos nuevos) la regresion ridge sobre todos los datos limpios')
+    parser.add_argument('--datos', '-i', type=str, default='datos_limpios', help='directorio particionado por periodo o un solo archivo Parquet')
+    parser.add_argument('--estadisticos', type=str, default='estadisticos_lineal.npz', help="sumas X'X y X'y acumuladas")
+    parser.add_argument('--alfa', type=float, default=1.0, help='penalizacion l2 de la ridge')
+    parser.add_argument('--salida', '-o', type=str, default='modelo_lineal.npz',
+                        help='pesos en el formato de ModeloNumpy; para servirlo, copiar como modelo_proyecto3.npz junto con el esquema')
+    parser.add_argument('--esquema', type=str, default='esquema_lineal.json')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    estadisticos, esquema, acumuladas = actualizar_estadisticos(args.datos, args.estadisticos)
+    pesos, intercepto = resolver_ridge(estadisticos, args.alfa)
+    guardar_lineal(pesos, intercepto, args.salida)
+    with open(args.esquema, 'w', encoding='utf-8') as archivo:
+        json.dump(esquema, archivo, ensure_ascii=False, indent=2)
+    print(f"{acumuladas} partes acumuladas, {estadisticos['n']} filas en total, {len(pesos)} columnas; "
+          f"modelo en {args.salida} ({time.perf_counter() - inicio:.1f} s)")
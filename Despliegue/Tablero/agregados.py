@@ -0,0 +1,69 @@
+import pandas as pd
+
+# Puntajes que se agregan en el cubo de la pestaña de exploración
+MEDIDAS = ['punt_global', 'punt_ingles', 'punt_matematicas', 'punt_sociales_ciudadanas', 'punt_c_naturales',
+           'punt_lectura_critica']
+
+
+def construir_cubo(df, dimensiones, medidas=MEDIDAS):
+    """
+    Precalcula, para cada dimension categorica, una tabla indexada por categoria con el conteo y la
+    suma, suma de cuadrados y media de cada medida.
+    :return: diccionario dimension -> DataFrame de agregados
+    """
+    cubo = {}
+    for dimension in dimensiones:
+        grupos = df[dimension]
+        tabla = pd.DataFrame({"conteo": df.groupby(grupos, observed=True).size()})
+        for medida in medidas:
+            valores = df[medida].astype("float64")
+            tabla[f"{medida}_suma"] = valores.groupby(grupos, observed=True).sum()
+            tabla[f"{medida}_suma_cuadrados"] = (valores ** 2).groupby(grupos, observed=True).sum()
+        cubo[dimension] = calcular_medias(tabla, medidas)
+    return cubo
+
+
+def calcular_medias(tabla, medidas=MEDIDAS):
+    """
+    Recalcula las medias a partir de los conteos y las sumas (las sumas son aditivas, las medias no).
+    :return: la misma tabla con las columnas <medida>_media actualizadas
+    """
+    for medida in medidas:
+        tabla[f"{medida}_media"] = tabla[f"{medida}_suma"] / tabla["conteo"]
+    return tabla
+
+
+def agregar_lote(cubo, lote, medidas=MEDIDAS):
+    """
+    Suma al cubo los agregados de un lote de filas nuevas (por ejemplo un periodo recien cargado) sin
+    volver a recorrer los datos anteriores: los conteos y las sumas se suman y las medias se recalculan.
+    :return: cubo nuevo con las mismas dimensiones; el cubo recibido no se modifica
+    """
+    nuevo = construir_cubo(lote, list(cubo), medidas)
+    actualizado = {}
+    for dimension, tabla in cubo.items():
+        aditivas = [columna for columna in tabla.columns if not columna.endswith("_media")]
+        # Las categorias de ambas tablas se unen y quedan en orden alfabetico
+        suma = pd.concat([tabla[aditivas], nuevo[dimension][aditivas]]).groupby(level=0, observed=True).sum()
+        actualizado[dimension] = calcular_medias(suma.rename_axis(dimension), medidas)
+    return actualizado
+
+
+def promedio_por_categoria(cubo, dimension, medida='punt_global'):
+    """
+    :return: DataFrame con la categoria y la media de la medida, en el formato que espera px.bar
+    """
+    tabla = cubo[dimension][f"{medida}_media"].rename(medida)
+    return tabla.rename_axis(dimension).reset_index()
+
+
+def promedio_por_año(cubo, medida='punt_global'):
+    """
+    El periodo es año y semestre (20221 -> 2022), asi que el promedio por año se obtiene sumando los
+    conteos y las sumas de los periodos de cada año en la dimension periodo del cubo.
+    :return: DataFrame con las columnas años y la media de la medida, en el formato que espera px.line
+    """
+    tabla = cubo['periodo']
+    por_año = tabla[['conteo', f"{medida}_suma"]].groupby(tabla.index // 10).sum()
+    medias = por_año[f"{medida}_suma"] / por_año["conteo"]
+    return pd.DataFrame({'años': por_año.index.to_numpy(), medida: medias.to_numpy()})
@@ -0,0 +1,38 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class CacheFiguras:
+    """
+    Cache LRU acotado de figuras de Plotly serializadas en JSON. La clave la arma quien llama,
+    normalmente (callback, valores de entrada, version de los datos).
+    """
+
+    def __init__(self, maximo=64):
+        self.maximo = maximo
+        self.figuras = OrderedDict()
+        # Flask puede atender callbacks en varios hilos a la vez
+        self.lock = threading.Lock()
+
+    def obtener(self, clave, construir):
+        """
+        Devuelve la figura guardada para la clave o la construye con construir() y la guarda,
+        sacando la menos usada si se supera el maximo.
+        :return: figura como diccionario, listo para un Output de Dash
+        """
+        with self.lock:
+            figura_json = self.figuras.get(clave)
+            if figura_json is not None:
+                self.figuras.move_to_end(clave)
+                return json.loads(figura_json)
+
+        figura_json = construir().to_json()
+
+        with self.lock:
+            self.figuras[clave] = figura_json
+            self.figuras.move_to_end(clave)
+            while len(self.figuras) > self.maximo:
+                self.figuras.popitem(last=False)
+        return json.loads(figura_json)
+
@@ -2,42 +2,97 @@ import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from scipy.stats import gaussian_kde
 import numpy as np
-import tensorflow as tf
-import keras
 import math  
+import io
+import os
+import json
+import threading
+from flask import request, jsonify
+from agregados import agregar_lote, construir_cubo, promedio_por_año, promedio_por_categoria
+from cache_figuras import CacheFiguras
+from inferencia import ModeloNumpy
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SKETCHY], suppress_callback_exceptions=True)
-
-# Data limpia
-df=pd.read_csv("datos_limpios.csv", sep = ",")
-
-df2 = df
-df2['años'] = df["periodo"] // 10
-df_promedio = df2.groupby("años", as_index=False).agg({"punt_global": "mean"})
-
-# Crear la gráfica de líneas
-fig_año = px.line(df_promedio, 
-              x="años", 
-              y="punt_global", 
-              title="Promedio Global según el Año de Presentación",
-              markers=True,
-              labels={"punt_global": "Promedio Global", "años": "Año de Presentación"},
-              color_discrete_sequence=["#28a745"])
-
-fig_año.update_layout(
-        plot_bgcolor="white",  # Fondo blanco
-        title_font=dict(family="Arial", size=18, color='green', weight='bold'),  # Título en negrita
-        title_x=0.5,  # Centra el título
-    )
-
-# Se trae el modelo, para poder predecir
-model = keras.models.load_model('modelo_proyecto3.keras')
+# Aplicacion WSGI para gunicorn (ver Despliegue/Tablero/gunicorn.conf.py)
+server = app.server
+
+# Data limpia, en Parquet con las variables de texto como category. Solo se leen las columnas de las
+# graficas de exploracion (los dropdowns de prediccion salen del esquema del modelo) y de los puntajes
+# solo el global, que es el unico que se grafica
+medidas_tablero = ['punt_global']
+columnas_tablero = ['periodo', 'cole_area_ubicacion', 'cole_caracter', 'cole_genero', 'cole_jornada', 'cole_mcpio_ubicacion',
+                    'cole_naturaleza', 'fami_cuartoshogar', 'fami_educacionmadre', 'fami_educacionpadre',
+                    'fami_estratovivienda', 'fami_personashogar', 'fami_tieneautomovil', 'fami_tienecomputador',
+                    'fami_tieneinternet', 'fami_tienelavadora'] + medidas_tablero
+# Tipos compactos: cada gunicorn worker tiene su propia copia de los datos
+tipos_tablero = {columna: 'category' for columna in columnas_tablero} | {'periodo': 'int32', 'punt_global': 'int16'}
+ruta_datos = "datos_limpios"
+
+# Los datos limpios son un directorio con una carpeta por periodo (ver Ingerir_Periodo.py). Se guarda
+# la lista de partes leidas para que refrescar_datos solo tenga que leer las que se agreguen despues.
+# Tambien sirve un solo Parquet (datos_limpios.parquet, como lo escriben Limpieza.py y Convertir_Parquet.py)
+def listar_partes(ruta):
+    if os.path.isfile(ruta):
+        return [ruta]
+    if not os.path.isdir(ruta) and os.path.isfile(ruta + '.parquet'):
+        return [ruta + '.parquet']
+    return sorted(os.path.join(raiz, nombre) for raiz, _, nombres in os.walk(ruta)
+                  for nombre in nombres if nombre.endswith('.parquet') and not nombre.startswith(('_', '.')))
+
+def leer_partes(partes):
+    # split_blocks y self_destruct liberan cada columna de Arrow a medida que se convierte, sin tener
+    # las dos copias completas en memoria
+    datos = pq.read_table(partes, columns=columnas_tablero).to_pandas(split_blocks=True, self_destruct=True).astype(tipos_tablero)
+    # Limpieza.py escribe cada parte por bloques y las categorias quedan en orden de aparicion; se
+    # ordenan alfabeticamente para que las graficas y los agregados salgan en el mismo orden de siempre
+    for columna in datos.select_dtypes('category').columns:
+        datos[columna] = datos[columna].cat.reorder_categories(sorted(datos[columna].cat.categories))
+    return datos
+
+partes_cargadas = listar_partes(ruta_datos)
+if not partes_cargadas:
+    raise FileNotFoundError(f"No hay datos limpios en {ruta_datos}: se espera el directorio por periodo de "
+                            f"Ingerir_Periodo.py o el archivo {ruta_datos}.parquet")
+df = leer_partes(partes_cargadas)
+# Segundos entre revisiones del directorio de datos en la pestaña de exploracion
+INTERVALO_RECARGA = int(os.environ.get("INTERVALO_RECARGA", 300))
+
+# Se trae el modelo, para poder predecir. El modelo se carga solo con la primera prediccion, asi las
+# pestañas de inicio y exploracion no pagan ese tiempo ni esa memoria. Si existen los pesos exportados
+# por Exportar_Modelo.py se predice con NumPy y TensorFlow/Keras no se importa nunca
+MOTOR_INFERENCIA = os.environ.get("MOTOR_INFERENCIA", "numpy" if os.path.exists('modelo_proyecto3.npz') else "keras")
+model = None
+lock_modelo = threading.Lock()
+
+def obtener_modelo():
+    global model
+    if model is None:
+        with lock_modelo:
+            if model is None:
+                if MOTOR_INFERENCIA == "numpy":
+                    model = ModeloNumpy.cargar('modelo_proyecto3.npz')
+                else:
+                    import keras
+                    model = keras.models.load_model('modelo_proyecto3.keras')
+    return model
+
+def predecir(indices):
+    # Recibe por fila las posiciones de las columnas one-hot activas (-1 para la categoria base).
+    # :return: arreglo 1D con una prediccion por fila
+    modelo = obtener_modelo()
+    if MOTOR_INFERENCIA == "numpy":
+        if inferencia_dispersa:
+            return modelo.predecir_indices(indices).ravel()
+        return modelo.predict(vector_denso(indices)).ravel()
+    return modelo(vector_denso(indices), training=False).numpy().ravel()
 
 # Layout de la pestaña de inicio del dash
 home_layout = html.Div([
@@ -157,7 +212,9 @@ data_exploration_layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     html.Label("Promedio global segúne el año de presentación:",className="form-label text-info", style={'fontWeight': 'bold'}),
-                    dcc.Graph(figure=fig_año)
+                    dcc.Graph(id='grafica-años'),
+                    # Cada cierto tiempo se revisa si llegaron periodos nuevos (ver refrescar_datos)
+                    dcc.Interval(id='intervalo-datos', interval=INTERVALO_RECARGA * 1000)
                 ], width=7),
 
                 dbc.Col([
@@ -176,14 +233,25 @@ data_exploration_layout = html.Div([
     ], className="mt-4 border-info", style={'borderWidth': '2px', 'borderStyle': 'solid', 'marginTop': '5px'}),
 ])
 
-# Callback para actualizar la gráfica
-@app.callback(
-    Output('dynamic-graph1', 'figure'),
-    [Input('variable_dropdown_graf1', 'value')]
-)
-def update_graph(selected_variable):
+# Cubo de agregados (conteo, suma, suma de cuadrados y media de cada puntaje) por periodo, por municipio
+# del colegio y por cada variable de los dropdowns de exploracion. Se calcula una vez al iniciar, los
+# callbacks solo hacen consultas y cuando llegan periodos nuevos se le suman sus agregados
+dimensiones_exploracion = ['fami_cuartoshogar', 'fami_educacionmadre', 'fami_educacionpadre', 'fami_estratovivienda',
+                           'fami_personashogar', 'fami_tieneautomovil', 'fami_tienecomputador', 'fami_tieneinternet',
+                           'fami_tienelavadora', 'cole_area_ubicacion', 'cole_caracter', 'cole_genero', 'cole_jornada',
+                           'cole_naturaleza']
+cubo_exploracion = construir_cubo(df, ['periodo', 'cole_mcpio_ubicacion'] + dimensiones_exploracion, medidas_tablero)
+
+# Con el cubo armado ningun callback usa las filas; se liberan para que cada worker no cargue con
+# ellas (los periodos nuevos se leen aparte en refrescar_datos). Las columnas vienen de buffers de
+# Arrow, asi que tambien se devuelve al sistema la memoria que Arrow deja reservada
+del df
+pa.default_memory_pool().release_unused()
+
+# Grafica de barras del promedio global por la variable seleccionada
+def figura_promedio(selected_variable):
     
-    grouped_df = df.groupby(selected_variable)['punt_global'].mean().reset_index()
+    grouped_df = promedio_por_categoria(cubo_exploracion, selected_variable)
     
     # Crear la gráfica de barras con un color verde (success)
     fig = px.bar(
@@ -204,35 +272,71 @@ def update_graph(selected_variable):
     
     return fig
 
+# Cache LRU de las figuras de exploracion, con la version de los datos en la clave para que una
+# recarga de datos no sirva figuras viejas
+version_datos = 0
+cache_figuras = CacheFiguras(maximo=int(os.environ.get("TAMANO_CACHE_FIGURAS", 64)))
+lock_datos = threading.Lock()
+
+def refrescar_datos():
+    """
+    Si Ingerir_Periodo.py agrego partes nuevas al directorio de datos, lee solo esas partes, suma sus
+    agregados al cubo y cambia la version de los datos, sin reiniciar el tablero.
+    :return: True si se cargaron datos nuevos
+    """
+    global cubo_exploracion, partes_cargadas, version_datos
+    with lock_datos:
+        nuevas = sorted(set(listar_partes(ruta_datos)) - set(partes_cargadas))
+        if not nuevas:
+            return False
+        cubo_exploracion = agregar_lote(cubo_exploracion, leer_partes(nuevas), medidas_tablero)
+        partes_cargadas = partes_cargadas + nuevas
+        version_datos += 1
+        return True
+
+# Grafica de lineas del promedio global por año de presentacion
+def figura_año():
+    fig_año = px.line(promedio_por_año(cubo_exploracion), 
+                  x="años", 
+                  y="punt_global", 
+                  title="Promedio Global según el Año de Presentación",
+                  markers=True,
+                  labels={"punt_global": "Promedio Global", "años": "Año de Presentación"},
+                  color_discrete_sequence=["#28a745"])
+
+    fig_año.update_layout(
+            plot_bgcolor="white",  # Fondo blanco
+            title_font=dict(family="Arial", size=18, color='green', weight='bold'),  # Título en negrita
+            title_x=0.5,  # Centra el título
+        )
+
+    return fig_año
+
+@app.callback(
+    Output('grafica-años', 'figure'),
+    [Input('intervalo-datos', 'n_intervals')]
+)
+def update_grafica_años(n_intervals):
+    refrescar_datos()
+    return cache_figuras.obtener(('grafica-años', version_datos), figura_año)
+
+# Callback para actualizar la gráfica
+@app.callback(
+    Output('dynamic-graph1', 'figure'),
+    [Input('variable_dropdown_graf1', 'value')]
+)
+def update_graph(selected_variable):
+    return cache_figuras.obtener(('dynamic-graph1', selected_variable, version_datos),
+                                 lambda: figura_promedio(selected_variable))
+
 # Callback para actualizar la gráfica
 @app.callback(
     Output('dynamic-graph2', 'figure'),
     [Input('variable_dropdown_graf2', 'value')]
 )
 def update_graph(selected_variable):
-    
-    grouped_df = df.groupby(selected_variable)['punt_global'].mean().reset_index()
-    
-    # Crear la gráfica de barras con un color verde (success)
-    fig = px.bar(
-        grouped_df,
-        x=selected_variable,  # Usamos la columna seleccionada como eje X
-        y='punt_global',  # Mostramos el promedio de punt_global en el eje Y
-        title=f'Promedio de Puntaje Global por {selected_variable}',
-        labels={selected_variable: selected_variable, 'punt_global': 'Promedio de Puntaje Global'},
-        color_discrete_sequence=["#28a745"]  # Estilo 'success' en color verde
-    )
-    
-    # Personalizar el diseño de la gráfica
-    fig.update_layout(
-        plot_bgcolor="white",  # Fondo blanco
-        title_font=dict(family="Arial", size=18, color='green', weight='bold'),  # Título en negrita
-        title_x=0.5,  # Centra el título
-    )
-    
-    return fig
-
-promedios_por_muni = df.groupby('cole_mcpio_ubicacion')['punt_global'].mean().reset_index()
+    return cache_figuras.obtener(('dynamic-graph2', selected_variable, version_datos),
+                                 lambda: figura_promedio(selected_variable))
 
 # Callback para actualizar la gráfica de barras de mejores/peores municipios
 @app.callback(
@@ -251,7 +355,11 @@ def update_bar_graph(n_clicks_top, n_clicks_bottom):
         }
 
     button_id = ctx.triggered[0]["prop_id"].split(".")[0]
+    return cache_figuras.obtener(("bar-graph", button_id, version_datos), lambda: figura_municipios(button_id))
 
+# Grafica de los mejores o peores municipios segun el boton presionado
+def figura_municipios(button_id):
+    promedios_por_muni = promedio_por_categoria(cubo_exploracion, 'cole_mcpio_ubicacion')
     if button_id == "btn-top-10":
         # Ordenar los municipios por el promedio del resultado de manera descendente
         df_sorted = promedios_por_muni.sort_values("punt_global", ascending=False).head(10)
@@ -271,7 +379,7 @@ def update_bar_graph(n_clicks_top, n_clicks_bottom):
                      title=title,
                      labels={"punt_global": "Promedio Global", "cole_mcpio_ubicacion": "Municipio"},
                      color_discrete_sequence=["#28a745"])
-    
+
     fig_bar.update_layout(
         plot_bgcolor="white",  # Fondo blanco
         title_font=dict(family="Arial", size=18, color='green', weight='bold'),  # Título en negrita
@@ -281,48 +389,55 @@ def update_bar_graph(n_clicks_top, n_clicks_bottom):
     return fig_bar
 
 
+# Esquema de codificacion que genera Entrenar_Modelo.py junto al modelo (categorias, categoria base
+# y orden de las columnas de entrada), asi el tablero codifica igual que en el entrenamiento. Las
+# opciones de los dropdowns salen de las mismas categorias: no hay que recorrer los datos y solo se
+# ofrecen valores que el modelo conoce
+with open("esquema_modelo.json", encoding="utf-8") as archivo:
+    esquema = json.load(archivo)
+
 texto = 'cole_mcpio_ubicacion_'
-mi_diccionario_mun_col = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["cole_mcpio_ubicacion"].unique())}
+mi_diccionario_mun_col = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["cole_mcpio_ubicacion"]["categorias"]}
 dropdown_options_mun_col = [{'label': key, 'value': value} for key, value in mi_diccionario_mun_col.items()]
 
 texto = 'estu_mcpio_presentacion_'
-mi_diccionario_mun_pres = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["estu_mcpio_presentacion"].unique())}
+mi_diccionario_mun_pres = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["estu_mcpio_presentacion"]["categorias"]}
 dropdown_options_mun_pres = [{'label': key, 'value': value} for key, value in mi_diccionario_mun_pres.items()]
 
 texto = 'estu_mcpio_reside_'
-mi_diccionario_mun_resid = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["estu_mcpio_reside"].unique())}
+mi_diccionario_mun_resid = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["estu_mcpio_reside"]["categorias"]}
 dropdown_options_mun_resid = [{'label': key, 'value': value} for key, value in mi_diccionario_mun_resid.items()]
 
 texto = 'fami_educacionmadre_'
-mi_diccionario_edu_madre = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["fami_educacionmadre"].unique())}
+mi_diccionario_edu_madre = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["fami_educacionmadre"]["categorias"]}
 dropdown_options_edu_madre = [{'label': key, 'value': value} for key, value in mi_diccionario_edu_madre.items()]
 
 texto = 'fami_educacionpadre_'
-mi_diccionario_edu_padre = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["fami_educacionpadre"].unique())}
+mi_diccionario_edu_padre = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["fami_educacionpadre"]["categorias"]}
 dropdown_options_edu_padre = [{'label': key, 'value': value} for key, value in mi_diccionario_edu_padre.items()]
 
 texto = 'fami_cuartoshogar_'
-mi_diccionario_cuarto_hogar = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["fami_cuartoshogar"].unique())}
+mi_diccionario_cuarto_hogar = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["fami_cuartoshogar"]["categorias"]}
 dropdown_options_cuarto_hogar = [{'label': key, 'value': value} for key, value in mi_diccionario_cuarto_hogar.items()]
 
 texto = 'fami_personashogar_'
-mi_diccionario_personas_hogar = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["fami_personashogar"].unique())}
+mi_diccionario_personas_hogar = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["fami_personashogar"]["categorias"]}
 dropdown_options_personas_hogar = [{'label': key, 'value': value} for key, value in mi_diccionario_personas_hogar.items()]
 
 texto = 'fami_estratovivienda_'
-mi_diccionario_estrato = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["fami_estratovivienda"].unique())}
+mi_diccionario_estrato = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["fami_estratovivienda"]["categorias"]}
 dropdown_options_estrato = [{'label': key, 'value': value} for key, value in mi_diccionario_estrato.items()]
 
 texto = 'cole_jornada_'
-mi_diccionario_jornada = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["cole_jornada"].unique())}
+mi_diccionario_jornada = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["cole_jornada"]["categorias"]}
 dropdown_options_jornada = [{'label': key, 'value': value} for key, value in mi_diccionario_jornada.items()]
 
 texto = 'cole_caracter_'
-mi_diccionario_formacion = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["cole_caracter"].unique())}
+mi_diccionario_formacion = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["cole_caracter"]["categorias"]}
 dropdown_options_formacion = [{'label': key, 'value': value} for key, value in mi_diccionario_formacion.items()]
 
 texto = 'desemp_ingles_'
-mi_diccionario_ingles_est = {ubicacion: f"{texto}{ubicacion}" for ubicacion in sorted(df["desemp_ingles"].unique())}
+mi_diccionario_ingles_est = {ubicacion: f"{texto}{ubicacion}" for ubicacion in esquema["variables"]["desemp_ingles"]["categorias"]}
 dropdown_options_ingles_est = [{'label': key, 'value': value} for key, value in mi_diccionario_ingles_est.items()]
 
 
@@ -644,7 +759,23 @@ predictions_layout = html.Div([
     ])
 ])
 
-@app.callback(
+# Barras de progreso calculadas en el navegador: solo cuentan campos llenos por grupo (9/3/5/2),
+# asi que no hace falta un viaje al servidor por cada cambio del formulario
+app.clientside_callback(
+    """
+    function() {
+        const valores = Array.from(arguments);
+        const grupos = [9, 3, 5, 2];
+        let inicio = 0;
+        return grupos.map(function(total) {
+            const llenos = valores.slice(inicio, inicio + total).filter(function(valor) {
+                return valor !== null && valor !== undefined;
+            }).length;
+            inicio += total;
+            return (llenos / total) * 100;
+        });
+    }
+    """,
     Output('progress-bar1', 'value'),
     Output('progress-bar2', 'value'),
     Output('progress-bar3', 'value'),
@@ -669,82 +800,80 @@ predictions_layout = html.Div([
     Input('genero_est-dropdown', 'value'),
     Input('ingles_est-dropdown', 'value')
 )
-def update_progress(automovil_value, computador_value, internet_value, lavadora_value, educ_madre_value, 
-                    educ_padre_value, cuartos_hogar_value, personas_hogar_value, estrato_value, mun_colegio_value, 
-                    mun_presentacion_value, mun_residencia_value, area_ubc_value, naturaleza_value, genero_colegio_value, 
-                    formacion_value, jornada_value, genero_est_value, ingles_est_value):
-    total_inputs1 = 9
-    filled_inputs1 = sum([
-        automovil_value is not None, 
-        computador_value is not None, 
-        internet_value is not None, 
-        lavadora_value is not None, 
-        educ_madre_value is not None, 
-        educ_padre_value is not None, 
-        cuartos_hogar_value is not None, 
-        personas_hogar_value is not None,
-        estrato_value is not None
-    ])
-    progress_percentage1 = (filled_inputs1 / total_inputs1) * 100
-
-    total_inputs2 = 3
-    filled_inputs2 = sum([
-        mun_colegio_value is not None,  
-        mun_presentacion_value is not None, 
-        mun_residencia_value is not None, 
-    ])
-    progress_percentage2 = (filled_inputs2 / total_inputs2) * 100
-
-    total_inputs3 = 5
-    filled_inputs3 = sum([
-        area_ubc_value is not None,  
-        naturaleza_value is not None, 
-        genero_colegio_value is not None,  
-        formacion_value is not None, 
-        jornada_value is not None,
-    ])
-    progress_percentage3 = (filled_inputs3 / total_inputs3) * 100
 
-    total_inputs4 = 2
-    filled_inputs4 = sum([
-        genero_est_value is not None,  
-        ingles_est_value is not None, 
-    ])
-    progress_percentage4 = (filled_inputs4 / total_inputs4) * 100
-
-
-    return progress_percentage1, progress_percentage2, progress_percentage3, progress_percentage4
-
-data_x = pd.read_csv("datax.csv")
+# Variables categoricas en el mismo orden usado por pd.get_dummies en el entrenamiento
+columnas_categoricas = list(esquema["variables"])
+
+# Indice precompilado columna -> posicion en el vector de entrada del modelo.
+# Se arma una sola vez a partir de los nombres de las columnas del encoder de entrenamiento,
+# asi la codificacion no depende de posiciones fijas
+indice_columnas = {columna: i for i, columna in enumerate(esquema["columnas"])}
+n_entradas = len(indice_columnas)
+
+# Nombres de la categoria base de cada variable: no tienen columna (drop_first) y se codifican como -1
+columnas_base = {f"{columna}_{variable['base']}" for columna, variable in esquema["variables"].items()}
+
+def codificar_valor(valor):
+    # Posicion de un valor del formulario; None si el modelo no conoce esa categoria
+    if valor in indice_columnas:
+        return indice_columnas[valor]
+    return -1 if valor in columnas_base else None
+
+# Las opciones escritas a mano en el formulario (RadioItems) deben existir en el esquema del modelo;
+# si no, el modelo las trataria como la categoria base sin avisar
+opciones_invalidas = sorted(opcion["value"] for componente in predictions_layout._traverse()
+                            if isinstance(componente, (dbc.RadioItems, dcc.Dropdown))
+                            for opcion in componente.options if codificar_valor(opcion["value"]) is None)
+if opciones_invalidas:
+    raise ValueError(f"Opciones del formulario que no estan en esquema_modelo.json: {opciones_invalidas}")
+
+# La suma de filas de pesos (predecir_indices) cuesta lo mismo sin importar el ancho de la entrada,
+# pero con las 148 columnas actuales el producto denso de BLAS sigue siendo mas rapido. En modo auto
+# se usa solo cuando hay muchas columnas por variable (p. ej. datos nacionales con cientos de municipios)
+INFERENCIA_DISPERSA = os.environ.get("INFERENCIA_DISPERSA", "auto")
+if INFERENCIA_DISPERSA == "auto":
+    inferencia_dispersa = n_entradas > 32 * len(columnas_categoricas)
+else:
+    inferencia_dispersa = INFERENCIA_DISPERSA == "1"
+
+def vector_denso(indices):
+    # Matriz one-hot completa a partir de las posiciones activas, para el motor de Keras
+    x = np.zeros((len(indices), n_entradas), dtype=np.float32)
+    filas, _ = np.nonzero(indices >= 0)
+    x[filas, indices[indices >= 0]] = 1
+    return x
 
 @app.callback(
     Output('warning-message', 'children'),
     Output('prediction-output', 'children'),
-    Input('automovil-options', 'value'),
-    Input('computador-options', 'value'),
-    Input('internet-options', 'value'),
-    Input('lavadora-options', 'value'),
-    Input('educ_madre-dropdown', 'value'),
-    Input('educ_padre-dropdown', 'value'),
-    Input('cuartos_hogar-dropdown', 'value'),
-    Input('personas_hogar-dropdown', 'value'),
-    Input('estrato-dropdown', 'value'),
-    Input('mun_colegio-dropdown', 'value'),
-    Input('mun_presentacion-dropdown', 'value'),
-    Input('mun_residencia-dropdown', 'value'),
-    Input('area_ubc-options', 'value'),
-    Input('naturaleza-options', 'value'),
-    Input('genero_colegio-options', 'value'),
-    Input('formacion-dropdown', 'value'),
-    Input('jornada-dropdown', 'value'),
-    Input('genero_est-dropdown', 'value'),
-    Input('ingles_est-dropdown', 'value'),
-    Input('predict-button', 'n_clicks')
+    # Solo el boton dispara la prediccion; los campos del formulario se leen como State para que
+    # cambiar un dropdown no vuelva a correr el modelo
+    Input('predict-button', 'n_clicks'),
+    State('automovil-options', 'value'),
+    State('computador-options', 'value'),
+    State('internet-options', 'value'),
+    State('lavadora-options', 'value'),
+    State('educ_madre-dropdown', 'value'),
+    State('educ_padre-dropdown', 'value'),
+    State('cuartos_hogar-dropdown', 'value'),
+    State('personas_hogar-dropdown', 'value'),
+    State('estrato-dropdown', 'value'),
+    State('mun_colegio-dropdown', 'value'),
+    State('mun_presentacion-dropdown', 'value'),
+    State('mun_residencia-dropdown', 'value'),
+    State('area_ubc-options', 'value'),
+    State('naturaleza-options', 'value'),
+    State('genero_colegio-options', 'value'),
+    State('formacion-dropdown', 'value'),
+    State('jornada-dropdown', 'value'),
+    State('genero_est-dropdown', 'value'),
+    State('ingles_est-dropdown', 'value'),
+    prevent_initial_call=True
 )
-def on_predict(automovil_value, computador_value, internet_value, lavadora_value, educ_madre_value, 
+def on_predict(n_clicks, automovil_value, computador_value, internet_value, lavadora_value, educ_madre_value, 
                     educ_padre_value, cuartos_hogar_value, personas_hogar_value, estrato_value, mun_colegio_value, 
                     mun_presentacion_value, mun_residencia_value, area_ubc_value, naturaleza_value, genero_colegio_value, 
-                    formacion_value, jornada_value, genero_est_value, ingles_est_value, n_clicks):
+                    formacion_value, jornada_value, genero_est_value, ingles_est_value):
     if n_clicks > 0:  # Only run if the button was clicked
         # Check if all inputs are filled
         inputs_filled = all([
@@ -769,74 +898,27 @@ def on_predict(automovil_value, computador_value, internet_value, lavadora_value
             ingles_est_value is not None,
         ])
         if inputs_filled:
-            variables = {
-                "area_ubicación": list(data_x.columns[0:1]),
-
-                "cole_formacion": list(data_x.columns[1:4]),
-
-                "cole_genero": list(data_x.columns[4:6]),
-
-                "cole_jornada": list(data_x.columns[6:11]),
-
-                "cole_muni_ubic": list(data_x.columns[11:49]),
-
-                "cole_naturaleza": list(data_x.columns[49:50]),
-
-                "estudiante_genero": list(data_x.columns[50:51]),
-
-                "estudiante_municipio_pres": list(data_x.columns[51:64]),
-
-                "estudiante_municipio_resd": list(data_x.columns[64:103]),
-
-                "cuartos_por_hogar": list(data_x.columns[103:108]),
-
-                "educacion_madre": list(data_x.columns[108:119]),
-
-                "educacion_padre": list(data_x.columns[119:130]),
-
-                "estrato": list(data_x.columns[130:136]),
-
-                "personas_por_hogar": list(data_x.columns[136:140]),
-
-                "auto": list(data_x.columns[140:141]),
-
-                "computador": list(data_x.columns[141:142]),
-
-                "internet": list(data_x.columns[142:143]),
-
-                "lavadora": list(data_x.columns[143:144]),
-
-                "nivel_ingles": list(data_x.columns[144:]),
-            }
-            x = []
-            dropdown_values = {
-                "auto": automovil_value,
-                "computador": computador_value,
-                "internet": internet_value,
-                "lavadora": lavadora_value,
-                "educacion_madre": educ_madre_value,
-                "educacion_padre": educ_padre_value,
-                "cuartos_por_hogar": cuartos_hogar_value,
-                "personas_por_hogar": personas_hogar_value,
-                "estrato": estrato_value,
-                "cole_muni_ubic": mun_colegio_value,
-                "estudiante_municipio_pres": mun_presentacion_value,
-                "estudiante_municipio_resd": mun_residencia_value,
-                "area_ubicación": area_ubc_value,
-                "cole_naturaleza": naturaleza_value,
-                "cole_genero": genero_colegio_value,
-                "cole_formacion": formacion_value,
-                "cole_jornada": jornada_value,
-                "estudiante_genero": genero_est_value,  
-                "nivel_ingles": ingles_est_value,
-            }
-
-            for var, options in variables.items():
-                selected_value = dropdown_values[var]
-                x.extend([1 if option == selected_value else 0 for option in options])
+            # Cada valor del formulario ya es el nombre de su columna one-hot; la categoria base
+            # (eliminada con drop_first) no tiene columna y queda como -1
+            posiciones = [codificar_valor(valor) for valor in [
+                automovil_value, computador_value, internet_value, lavadora_value, educ_madre_value,
+                educ_padre_value, cuartos_hogar_value, personas_hogar_value, estrato_value, mun_colegio_value,
+                mun_presentacion_value, mun_residencia_value, area_ubc_value, naturaleza_value, genero_colegio_value,
+                formacion_value, jornada_value, genero_est_value, ingles_est_value]]
+            if None in posiciones:
+                return dbc.Alert(
+                    html.Div([
+                        html.H4("¡Error!", className="alert-heading"),
+                        html.P("Algun valor seleccionado no es una categoria conocida por el modelo", className="mb-0"),
+                    ]),
+                    color="danger",
+                    is_open=True,
+                    dismissable=True,
+                    duration=7000,
+                ), None
+            indices = np.array([posiciones])
 
-            prediction_result = model.predict([x]) 
-            resultado = prediction_result[0][0]
+            resultado = predecir(indices)[0]
 
             prediction_message = f"El resultado esperado es: {resultado:.0f}"
 
@@ -855,6 +937,72 @@ def on_predict(automovil_value, computador_value, internet_value, lavadora_value
     
     return dash.no_update  # If button has not been clicked, do nothing
 
+# Endpoint REST para predecir cohortes completas (JSON o CSV) sin pasar por el formulario
+TAMANO_LOTE = int(os.environ.get("TAMANO_LOTE", 1024))
+
+def codificar_lote(registros):
+    # Posiciones one-hot activas de todos los registros a la vez: una columna por variable categorica,
+    # -1 para la categoria base (drop_first), que no esta en el indice
+    indices = np.empty((len(registros), len(columnas_categoricas)), dtype=np.int64)
+    for j, columna in enumerate(columnas_categoricas):
+        posiciones = (columna + "_" + registros[columna].astype(str)).map(indice_columnas)
+        indices[:, j] = posiciones.fillna(-1).to_numpy(dtype=np.int64)
+    return indices
+
+@app.server.route("/api/predicciones", methods=["POST"])
+def predecir_lote():
+    # Con type=int un valor invalido se volvia el valor por defecto; aqui se rechaza
+    tamano_lote = request.args.get("tamano_lote")
+    if tamano_lote is None:
+        tamano_lote = TAMANO_LOTE
+    elif not tamano_lote.strip().isdecimal() or int(tamano_lote) <= 0:
+        return jsonify({"error": "tamano_lote debe ser un entero positivo"}), 400
+    else:
+        tamano_lote = int(tamano_lote)
+
+    # Se aceptan registros crudos: una lista JSON (o {"registros": [...]}) o un CSV con encabezado
+    if request.mimetype == "text/csv":
+        try:
+            registros = pd.read_csv(io.StringIO(request.get_data(as_text=True)), dtype=str)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError):
+            return jsonify({"error": "No se pudo leer el CSV; se esperaba un archivo con encabezado"}), 400
+    else:
+        cuerpo = request.get_json(silent=True)
+        if isinstance(cuerpo, dict):
+            cuerpo = cuerpo.get("registros")
+        if not isinstance(cuerpo, list):
+            return jsonify({"error": "Se esperaba una lista de registros en JSON o un archivo CSV"}), 400
+        registros = pd.DataFrame(cuerpo)
+
+    if registros.empty:
+        return jsonify({"predicciones": []})
+
+    faltantes = [columna for columna in columnas_categoricas if columna not in registros.columns]
+    if faltantes:
+        return jsonify({"error": "Faltan columnas en los registros", "faltantes": faltantes}), 400
+
+    # Categorias que el modelo no vio en el entrenamiento se rechazan en vez de codificarse como la base;
+    # los valores faltantes se reportan aparte (cuantos hay por columna), porque NaN no es JSON valido
+    desconocidas, nulos = {}, {}
+    for columna in columnas_categoricas:
+        faltan = registros[columna].isna()
+        if faltan.any():
+            nulos[columna] = int(faltan.sum())
+        valores = registros.loc[~faltan, columna].astype(str)
+        invalidos = valores[~valores.isin(esquema["variables"][columna]["categorias"])]
+        if not invalidos.empty:
+            desconocidas[columna] = sorted(invalidos.unique())
+    if desconocidas or nulos:
+        return jsonify({"error": "Hay categorias desconocidas o valores faltantes para el modelo",
+                        "desconocidas": desconocidas, "nulos": nulos}), 400
+
+    indices = codificar_lote(registros)
+    # Un solo llamado vectorizado al modelo por cada micro-lote
+    predicciones = [predecir(indices[i:i + tamano_lote]) for i in range(0, len(indices), tamano_lote)]
+    predicciones = np.concatenate(predicciones) if predicciones else np.empty(0)
+
+    return jsonify({"predicciones": predicciones.tolist()})
+
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),  # Detectar la URL activa
     dbc.NavbarSimple(
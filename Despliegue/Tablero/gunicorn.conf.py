@@ -0,0 +1,30 @@
+import gc
+import os
+
+# Configuracion de gunicorn para el tablero: gunicorn lee este archivo si se corre desde esta carpeta
+#   gunicorn            (o gunicorn -c gunicorn.conf.py dash_app:server)
+wsgi_app = "dash_app:server"
+bind = os.environ.get("BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+
+# El maestro importa dash_app una sola vez (datos, cubo de agregados, catalogos y librerias) antes de
+# crear los workers. Los workers nacen con fork y comparten esas paginas de memoria en modo solo lectura
+# (copy-on-write), asi que la memoria total casi no crece al agregar workers
+preload_app = True
+
+
+def when_ready(server):
+    """
+    Corre en el maestro despues de importar la aplicacion y antes del primer fork.
+    """
+    import dash_app
+
+    # Los pesos NumPy se cargan aqui para que todos los workers compartan la misma copia. Con Keras no:
+    # TensorFlow arranca hilos que no sobreviven al fork, asi que cada worker lo carga en su primera
+    # prediccion
+    if dash_app.MOTOR_INFERENCIA == "numpy":
+        dash_app.obtener_modelo()
+
+    # Los objetos ya creados pasan a la generacion permanente del recolector de basura: si no, la
+    # primera recoleccion de cada worker los recorre, escribe en sus encabezados y copia las paginas
+    gc.freeze()
@@ -0,0 +1,57 @@
+import numpy as np
+
+# Activaciones soportadas por el motor NumPy (las mismas que permite Entrenar_Modelo.py, salvo prelu)
+ACTIVACIONES = {
+    "relu": lambda z: np.maximum(z, 0),
+    "tanh": np.tanh,
+    "linear": lambda z: z,
+}
+
+
+class ModeloNumpy:
+    """
+    Red densa exportada por Exportar_Modelo.py: cada capa es (pesos, sesgos, activacion), con la
+    BatchNormalization ya plegada en los pesos de la capa siguiente. Predice sin TensorFlow.
+    """
+
+    def __init__(self, capas):
+        self.capas = capas
+        # Pesos de la primera capa con una fila de ceros al final: la posicion -1 (variable en su
+        # categoria base, sin columna one-hot) no suma nada en predecir_indices
+        pesos, _, _ = capas[0]
+        self.pesos_entrada = np.vstack([pesos, np.zeros((1, pesos.shape[1]), dtype=pesos.dtype)])
+
+    @classmethod
+    def cargar(cls, ruta):
+        with np.load(ruta) as archivo:
+            activaciones = [str(activacion) for activacion in archivo["activaciones"]]
+            capas = [(archivo[f"pesos_{i}"], archivo[f"sesgos_{i}"], activacion)
+                     for i, activacion in enumerate(activaciones)]
+        return cls(capas)
+
+    def predict(self, x):
+        """
+        :return: arreglo (n, 1) con las predicciones, igual que model.predict de Keras
+        """
+        salida = np.asarray(x, dtype=np.float32)
+        for pesos, sesgos, activacion in self.capas:
+            salida = ACTIVACIONES[activacion](salida @ pesos + sesgos)
+        return salida
+
+    def predecir_indices(self, indices):
+        """
+        Igual que predict, pero cada fila trae solo las posiciones de sus columnas activas (una por
+        variable categorica, -1 si esta en la categoria base). Como la entrada es one-hot, la primera
+        capa es la suma de las filas de pesos seleccionadas en vez de un producto con la matriz completa.
+        :return: arreglo (n, 1) con las predicciones
+        """
+        _, sesgos, activacion = self.capas[0]
+        indices = np.asarray(indices)
+        # Se acumula variable por variable para no armar un arreglo intermedio (n, variables, neuronas)
+        suma = np.take(self.pesos_entrada, indices[:, 0], axis=0)
+        for j in range(1, indices.shape[1]):
+            suma += np.take(self.pesos_entrada, indices[:, j], axis=0)
+        salida = ACTIVACIONES[activacion](suma + sesgos)
+        for pesos, sesgos, activacion in self.capas[1:]:
+            salida = ACTIVACIONES[activacion](salida @ pesos + sesgos)
+        return salida